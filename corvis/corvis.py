@@ -8,6 +8,15 @@ import math
 import time
 import us
 import random
+import warnings
+import json
+import os
+import concurrent.futures
+import collections
+import threading
+import hashlib
+import io
+import zlib
 
 
 class CORVISDatasources(Enum):
@@ -61,6 +70,9 @@ CORVISAggregatorColumnNames = ['Source', 'Metric', 'Country/Region', 'Province/S
 CORVISBaselineColumnNames = ['Source', 'Metric', 'Country/Region', 'Province/State', 'County', 'Population', 'Lat', 'Long']
 CORVISBreakpointColumnNames = ['Source', 'Metric', 'Country/Region', 'Province/State', 'County', 'Population',  'Lat', 'Long', 'DayZero']
 
+# the DataFrame.attrs key under which CORVIS dataframes carry their schema (see SetCORVISSchema()).
+CORVISSchemaAttributeName = 'corvisSchema'
+
 # at present, we're supporting both the JHU dataset and The COVID Tracking Project (CTP) datasets.
 
 # QUIRKS: several nations have unusual reporting in the JHU dataset. They are:
@@ -75,18 +87,62 @@ CORVISBreakpointColumnNames = ['Source', 'Metric', 'Country/Region', 'Province/S
 
 CORVISIgnoreStatesForNationalCount = ['US']
 
+# datasource adapters LoadCORVISData() can load from, keyed by CORVISDatasources value (see RegisterCORVISDatasourceAdapter()),
+# and the levels of detail a datasource file can report at, coarsest first.
+CORVISDatasourceAdapters = collections.OrderedDict()
+CORVISGranularities = ['country', 'state', 'county']
+
+# when combining datasources, rows are matched up on every aggregator column except 'Source'.
+CORVISLocationColumnNames = ['Metric', 'Country/Region', 'Province/State', 'County']
+
+# aggregations over many date columns are split into blocks of this many columns,
+# and run on this many threads. 'None' uses one thread per CPU.
+CORVISAggregationBlockSize = 64
+CORVISAggregationThreads = None
+
+# ComputeCORVISLaggedCorrelation() works through reference rows in batches of about this many bytes.
+CORVISCorrelationBlockBytes = 64*1024*1024
+
+# spatial indexes for the dataframes we've filtered by location recently (see GetCORVISSpatialIndex()).
+CORVISEarthRadiusKm = 6371.0
+CORVISSpatialIndexCacheSize = 8
+CORVISSpatialIndexCache = collections.OrderedDict()
+
+# memoized FilterCORVISData() results. 'None' means the cache is off; see EnableCORVISFilterCache().
+CORVISFilterCache = None
+
+# rendered CreateCORVISPlot() charts. 'None' means the cache is off; see EnableCORVISPlotCache().
+CORVISPlotCache = None
+
 def VerifyCORVISDataframe(sourceCORVISDataframe):
-  if not isinstance(sourceCORVISDataframe, pd.DataFrame):
+  if IsCORVISArrowSchema(sourceCORVISDataframe):
+    # an Arrow schema (see ReadCORVISArrowSchema()): we can check the columns
+    # without touching the data. The row count is recorded when we export.
+    columnNames = sourceCORVISDataframe.names
+    rowCount = GetCORVISArrowMetadata(sourceCORVISDataframe).get('rows', None)
+  elif isinstance(sourceCORVISDataframe, pd.DataFrame):
+    columnNames = sourceCORVISDataframe.columns
+    rowCount = sourceCORVISDataframe.shape[0]
+  else:
     raise ValueError("ERROR in VerifyCORVISDataframe(): this is not a valid CORVIS dataframe.")
-  if sourceCORVISDataframe.shape[0] == 0:
+  if rowCount == 0:
     raise ValueError("ERROR in VerifyCORVISDataframe(): This dataframe is empty.")
+
+  # dataframes we've already checked (including everything this library returns)
+  # carry a schema record; if their columns still match it, we're done.
+  if isinstance(sourceCORVISDataframe, pd.DataFrame) and (GetCORVISSchema(sourceCORVISDataframe) is not None):
+    return True
+
   necessaryBaselineColumns = len(CORVISBaselineColumnNames)
-  for currentColumn in sourceCORVISDataframe.columns:
+  for currentColumn in columnNames:
     if currentColumn in CORVISBaselineColumnNames:
       necessaryBaselineColumns = necessaryBaselineColumns - 1
     else:
       if (necessaryBaselineColumns <= 0):
-        # we have all our necessary baseline columns, so we can safely assume this is a valid CORVIS dataframe. Return true.
+        # we have all our necessary baseline columns, so we can safely assume this is a valid CORVIS dataframe.
+        # Record that, so we don't have to check again, and return true.
+        if isinstance(sourceCORVISDataframe, pd.DataFrame):
+          SetCORVISSchema(sourceCORVISDataframe)
         return True
       else:
         # if we get here, we've found a column that is NOT a baseline column where we're expecting a baseline column. Throw an exception.
@@ -96,11 +152,56 @@ def VerifyCORVISDataframe(sourceCORVISDataframe):
 
 
 def FindCORVISDataframeBreakPoint(datasetToUse):
+  dataSchema = GetCORVISSchema(datasetToUse)
+  if dataSchema is not None:
+    return dataSchema['breakpoint']
   for i in range(len(datasetToUse.columns)):
     if not datasetToUse.columns[i] in CORVISBreakpointColumnNames:
       return i
   return -1
 
+def SetCORVISSchema(sourceCORVISDataframe, datasetBreakpoint=None):
+  # record a validated CORVIS dataframe's schema in its 'attrs', where pandas
+  # carries it along through copies and row selections. Its location columns
+  # and first date column let GetCORVISSchema() tell whether the record still
+  # applies, without walking the columns. Callers must only pass dataframes
+  # that pass VerifyCORVISDataframe().
+  if datasetBreakpoint is None:
+    datasetBreakpoint = FindCORVISDataframeBreakPoint(sourceCORVISDataframe)
+  if datasetBreakpoint < 0:
+    # no date columns, so nothing to record.
+    return sourceCORVISDataframe
+  locationColumns = list(sourceCORVISDataframe.columns[: datasetBreakpoint])
+  sourceCORVISDataframe.attrs[CORVISSchemaAttributeName] = {'breakpoint': datasetBreakpoint, 'locationColumns': locationColumns,
+                                                            'firstDateColumn': sourceCORVISDataframe.columns[datasetBreakpoint],
+                                                            'dateAxis': 'DayZero' if ('DayZero' in locationColumns) else 'calendar', 'validated': True}
+  return sourceCORVISDataframe
+
+def GetCORVISSchema(sourceCORVISDataframe):
+  # the schema recorded by SetCORVISSchema(), or None if there isn't one, or if
+  # columns have been added, removed, or renamed in front of the data since.
+  dataSchema = getattr(sourceCORVISDataframe, 'attrs', {}).get(CORVISSchemaAttributeName, None)
+  if not (isinstance(dataSchema, dict) and dataSchema.get('validated', False)):
+    return None
+  # each recorded column must still be where we left it. The column index looks
+  # names up in a hash table, so this costs the same however many days we have.
+  columnNames = sourceCORVISDataframe.columns
+  for columnPosition, columnName in enumerate(dataSchema['locationColumns'] + [dataSchema['firstDateColumn']]):
+    try:
+      columnLocation = columnNames.get_loc(columnName)
+    except (KeyError, TypeError):
+      return None
+    if not (isinstance(columnLocation, (int, np.integer)) and (columnLocation == columnPosition)):
+      return None
+  return dataSchema
+
+def GetCORVISDateAxis(sourceCORVISDataframe):
+  # 'DayZero' for dataframes from TransformCORVISDataToDayZero(), 'calendar' otherwise.
+  dataSchema = GetCORVISSchema(sourceCORVISDataframe)
+  if dataSchema is not None:
+    return dataSchema['dateAxis']
+  return 'DayZero' if ('DayZero' in sourceCORVISDataframe.columns[: FindCORVISDataframeBreakPoint(sourceCORVISDataframe)]) else 'calendar'
+
 def GetCORVISThresholdDateLambda(row, thresholdValue, sourceDataframe):
 
   for i in range(row.shape[0]):
@@ -134,251 +235,290 @@ def GetCORVISPopulationLambda(row, refTable):
   
 
 
-def LoadCORVISData(datasourceToLoad = CORVISDatasources.ALL, dataPath='./', forceDownload=False, verbose=True):
-
-  if verbose:
-    print('loading from datasource: ' + str(datasourceToLoad.value))  
-  proceedWithDownload = False
+class CORVISDatasourceAdapter:
+
+  # This is the interface every datasource plugs into. An adapter lists the
+  # files its datasource provides in 'files'; each file is a dictionary with:
+  #   'key':          a short name for the file (also used for its cache file.)
+  #   'metrics':      the CORVISMetrics values it holds (empty for lookup tables.)
+  #   'countries':    the countries it covers, or None for every country.
+  #   'excludeCountries': countries it nominally covers, but whose rows we
+  #                   always drop (optional.)
+  #   'granularity':  the finest level it reports at: 'country', 'state', or 'county'.
+  # Subclasses set 'datasource', 'name', and 'files', and implement
+  # GetFingerprint() and DownloadFile() (or DownloadFiles(), if one download
+  # produces several files.) The base class takes care of choosing files,
+  # caching them on disk, and checking each one's fingerprint.
+
+  datasource = None
+  name = ''
+  cacheFilePrefix = None
+  files = []
+  populationFileKey = None
+
+  def GetFingerprint(self, verbose=False):
+    # return a string that changes whenever the server has new data, or None if we can't reach the server.
+    raise NotImplementedError
+
+  def DownloadFile(self, fileSpec, verbose=False):
+    # download a single file and return it as a dataframe with CORVIS column names.
+    raise NotImplementedError
+
+  def DownloadFiles(self, fileSpecs, verbose=False):
+    return {x['key']:self.DownloadFile(x, verbose) for x in fileSpecs}
+
+  def ReadLegacyFingerprint(self, dataPath='./'):
+    # the fingerprint saved by versions of LoadCORVISData() from before per-file
+    # fingerprints, if this datasource had one; None otherwise. It applies to every file.
+    return None
+
+  def SelectFiles(self, metrics=None, countries=None, granularity=None):
+    # pick the files that hold any of the requested metrics and countries, at the
+    # requested level of detail or finer. 'None' means "anything". Lookup tables
+    # (files without metrics) are never picked; LoadCORVISData() asks for the
+    # population table itself when it needs it.
+    selectedFiles = []
+    for fileSpec in self.files:
+      if (len(fileSpec['metrics']) == 0):
+        continue
+      if (metrics is not None) and not (set(metrics) & set(fileSpec['metrics'])):
+        continue
+      if (countries is not None):
+        usefulCountries = set(countries) - set(fileSpec.get('excludeCountries', []))
+        if (fileSpec['countries'] is not None):
+          usefulCountries = usefulCountries & set(fileSpec['countries'])
+        if not usefulCountries:
+          continue
+      if (granularity is not None) and (CORVISGranularities.index(fileSpec['granularity']) < CORVISGranularities.index(granularity)):
+        continue
+      selectedFiles.append(fileSpec)
+    return selectedFiles
+
+  def GetCacheFileName(self, dataPath, fileSpec):
+    cacheFilePrefix = self.cacheFilePrefix
+    if cacheFilePrefix is None:
+      cacheFilePrefix = '.' + self.name + '_'
+    return dataPath + cacheFilePrefix + fileSpec['key'] + '.csv'
+
+  def LoadFiles(self, fileSpecs, dataPath='./', forceDownload=False, verbose=True):
+
+    # load each requested file from our local cache if its fingerprint matches
+    # the server's, and download (and cache) the rest.
+    fingerprintFileName = dataPath + '.' + self.name + '_fingerprints.json'
+    try:
+      with open(fingerprintFileName, 'r') as fingerprintFile:
+        localFingerprints = json.load(fingerprintFile)
+    except (IOError, ValueError):
+      # carry over the fingerprint from an older cache, so its files aren't downloaded again.
+      legacyFingerprint = self.ReadLegacyFingerprint(dataPath)
+      if legacyFingerprint is None:
+        localFingerprints = {}
+      else:
+        localFingerprints = {x['key']:legacyFingerprint for x in self.files}
 
-  ##########################
-  ##### LOAD JHU DATA. #####
-  ##########################
-  
-  if ((datasourceToLoad == CORVISDatasources.ALL) | (datasourceToLoad == CORVISDatasources.JHU)):
     if verbose:
-      print('Loading JHU data...')
+      print('Loading ' + self.name.upper() + ' data...')
+    remoteFingerprint = self.GetFingerprint(verbose)
+    if (remoteFingerprint is None):
+      print('WARNING: Cannot connect to ' + self.name.upper() + ' server. Using local data instead. Data may be out of date.')
+
+    loadedFiles = {}
+    filesToDownload = []
+    for fileSpec in fileSpecs:
+      cacheIsCurrent = (remoteFingerprint is None) or (localFingerprints.get(fileSpec['key'], None) == remoteFingerprint)
+      if cacheIsCurrent and not forceDownload:
+        try:
+          loadedFiles[fileSpec['key']] = pd.read_csv(self.GetCacheFileName(dataPath, fileSpec))
+          continue
+        except IOError:
+          pass
+      if (remoteFingerprint is None):
+        raise IOError("FATAL ERROR: Cannot connect to " + self.name.upper() + " server, and no local copy of '" + fileSpec['key'] + "' is available. Aborting.")
+      filesToDownload.append(fileSpec)
 
-    canConnectToGithub = True
+    if verbose:
+      if (len(filesToDownload) > 0):
+        print('Downloading ' + str(len(filesToDownload)) + ' ' + self.name.upper() + ' file(s); ' + str(len(loadedFiles)) + ' loaded from local data.')
+      else:
+        print('Latest ' + self.name.upper() + ' data already available.')
+
+    if (len(filesToDownload) > 0):
+      downloadedFiles = self.DownloadFiles(filesToDownload, verbose)
+      for fileSpec in filesToDownload:
+        downloadedFiles[fileSpec['key']].to_csv(self.GetCacheFileName(dataPath, fileSpec), index=False)
+        localFingerprints[fileSpec['key']] = remoteFingerprint
+        loadedFiles[fileSpec['key']] = downloadedFiles[fileSpec['key']]
+      with open(fingerprintFileName, 'w') as fingerprintFile:
+        json.dump(localFingerprints, fingerprintFile)
+
+    return [loadedFiles[x['key']] for x in fileSpecs]
+
+
+class CORVISJHUAdapter(CORVISDatasourceAdapter):
+
+  # the 2019 Novel Coronavirus COVID-19 (2019-nCoV) Data Repository by Johns Hopkins CSSE.
+  datasource = CORVISDatasources.JHU
+  name = 'jhu'
+  populationFileKey = 'lookupTable'
+  baseURL = 'https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/'
+  files = [
+    {'key': 'timeSeriesConfirmedUS', 'metrics': ['Confirmed'], 'countries': ['US'], 'granularity': 'county', 'url': 'csse_covid_19_time_series/time_series_covid19_confirmed_US.csv'},
+    {'key': 'timeSeriesDeathUS', 'metrics': ['Death'], 'countries': ['US'], 'granularity': 'county', 'url': 'csse_covid_19_time_series/time_series_covid19_deaths_US.csv'},
+    # the global files report the US as a single national total, which we drop (see CORVISIgnoreStatesForNationalCount.)
+    {'key': 'timeSeriesConfirmedGlobal', 'metrics': ['Confirmed'], 'countries': None, 'excludeCountries': CORVISIgnoreStatesForNationalCount, 'granularity': 'state', 'url': 'csse_covid_19_time_series/time_series_covid19_confirmed_global.csv'},
+    {'key': 'timeSeriesDeathGlobal', 'metrics': ['Death'], 'countries': None, 'excludeCountries': CORVISIgnoreStatesForNationalCount, 'granularity': 'state', 'url': 'csse_covid_19_time_series/time_series_covid19_deaths_global.csv'},
+    {'key': 'timeSeriesRecoveredGlobal', 'metrics': ['Recovered'], 'countries': None, 'excludeCountries': CORVISIgnoreStatesForNationalCount, 'granularity': 'state', 'url': 'csse_covid_19_time_series/time_series_covid19_recovered_global.csv'},
+    # demographic/region lookup table, used to fill in populations.
+    {'key': 'lookupTable', 'metrics': [], 'countries': None, 'granularity': 'county', 'url': 'UID_ISO_FIPS_LookUp_Table.csv'},
+  ]
+
+  def GetFingerprint(self, verbose=False):
+    # the latest commit on the repository's master branch.
     try:
       repoInfo = pd.read_json('https://api.github.com/repos/CSSEGISandData/COVID-19/branches/master')
-      repoInfo.commit.sha # check to see if we successfully loaded our repo info.
-    except NameError:
-      if verbose:
-        print("ERROR: could not connect to JHU CORVISDatasources.")
-        canConnectToGithub = False
+      return str(repoInfo.commit.sha)
+    except Exception:
+      return None
 
+  def ReadLegacyFingerprint(self, dataPath='./'):
+    # older versions saved the repository info to '~/.jhuRepoInfo.json', but looked for it in dataPath.
+    for repoInfoFileName in [dataPath + '.jhuRepoInfo.json', '~/.jhuRepoInfo.json']:
+      try:
+        return str(pd.read_json(repoInfoFileName).commit.sha)
+      except Exception:
+        pass
+    return None
 
+  def DownloadFile(self, fileSpec, verbose=False):
+    if verbose:
+      print('loading JHU ' + fileSpec['key'] + '...')
+    downloadedFile = pd.read_csv(self.baseURL + fileSpec['url'])
+    if (fileSpec['key'] == self.populationFileKey):
+      return downloadedFile
+
+    # JHU's data is a bit inconsistent across sets, so we line up the US files with the global ones by hand.
+    if (fileSpec['countries'] == ['US']):
+      downloadedFile = downloadedFile.drop(['UID','iso2','iso3','code3','FIPS','Combined_Key'], axis=1)
+      downloadedFile = downloadedFile.rename(columns={"Long_": "Long", "Province_State": "Province/State", "Country_Region": "Country/Region", "Admin2": "County"})
+    downloadedFile['Metric'] = fileSpec['metrics'][0]
+    downloadedFile['Source'] = self.datasource.value
+    return downloadedFile
+
+
+class CORVISCTPAdapter(CORVISDatasourceAdapter):
+
+  # The COVID Tracking Project. Every metric comes from a single state-by-state
+  # download, which we split into one time series per metric.
+  datasource = CORVISDatasources.CTP
+  name = 'ctp'
+  cacheFilePrefix = '.cpt_'
+  ctpMetrics = {'positive': CORVISMetrics.CONFIRMED, 'negative': CORVISMetrics.NEGATIVE, 'hospitalizedCumulative': CORVISMetrics.HOSPITALIZED, 'inIcuCumulative': CORVISMetrics.ICU,
+                'onVentilatorCumulative': CORVISMetrics.VENTILATOR, 'recovered': CORVISMetrics.RECOVERED, 'death': CORVISMetrics.DEATH}
+  files = [{'key': 'timeSeries' + x, 'ctpMetric': x, 'metrics': [y.value], 'countries': ['US'], 'granularity': 'state'} for x, y in ctpMetrics.items()]
+
+  def GetFingerprint(self, verbose=False):
+    # the last time the national summary was modified.
     try:
-      lastRepoInfoJHU = pd.read_json(dataPath+'.jhuRepoInfo.json')
-    except:
-      # if we couldn't even connect to Github, we're out of options. Fail out.
-      if canConnectToGithub == False:
-        print('ERROR: could not load local JHU data.')
-        print('FATAL ERROR: cannot obtain JHU data remotely or locally.')
-        exit(0)
-      # if this file doesn't exist, pretend it does, but ruin the fingerprint.
-      lastRepoInfoJHU = repoInfo
-      lastRepoInfoJHU.commit.sha = "MISSING_LOCAL_FINGERPRINT"
-
-    # next, confirm that we have all our necessary dataframes loaded.
-    pd.set_option('mode.chained_assignment', None) # temporarily disable 'SettingWithCopyWarning' message
-    try:
-      timeSeriesConfirmedUS = pd.read_csv(dataPath+'.jhu_timeSeriesConfirmedUS.csv')
-      timeSeriesConfirmedGlobal = pd.read_csv(dataPath+'.jhu_timeSeriesConfirmedGlobal.csv')
-      timeSeriesDeathUS = pd.read_csv(dataPath+'.jhu_timeSeriesDeathUS.csv')
-      timeSeriesDeathGlobal = pd.read_csv(dataPath+'.jhu_timeSeriesDeathGlobal.csv')
-      timeSeriesRecoveredGlobal = pd.read_csv(dataPath+'.jhu_timeSeriesRecoveredGlobal.csv')
-      lookupTable = pd.read_csv(dataPath+'.jhu_lookupTable.csv')
-    except:
-      # we don't have the data loaded locally; re-download.
-      proceedWithDownload = True
-      lastRepoInfoJHU.commit.sha = str(random.random)
-    else:
-      if verbose:
-        print('Local JHU data available; checking for updates on server...')
-      
-    pd.set_option('mode.chained_assignment', 'warn')
-
+      return str(pd.read_json('https://covidtracking.com/api/v1/us/current.json').lastModified[0])
+    except Exception:
+      return None
 
+  def ReadLegacyFingerprint(self, dataPath='./'):
     try:
-      lastRepoInfoJHU
-      if verbose:
-        print("checking data fingerprints: " + str(lastRepoInfoJHU.commit.sha) + " == " + str(repoInfo.commit.sha) + "? [" + str(lastRepoInfoJHU.commit.sha == repoInfo.commit.sha) + "]")
-    except:
-      if verbose:
-        print('JHU data not yet downloaded. Beginning download...')
-      proceedWithDownload = True
-    else:
-      if (lastRepoInfoJHU.commit.sha == repoInfo.commit.sha):
-        if verbose:
-          print('Latest JHU data already available.')
-      else:
-        if verbose:
-          print('Updated JHU data available; downloading...')
-        proceedWithDownload = True
-
-    if forceDownload:
-      if verbose:
-        print("Forcing re-download of JHU data.")
-      proceedWithDownload = True
-
-    if proceedWithDownload:
-      try:
-        if verbose:
-          print('loading confirmed US cases...')
-        timeSeriesConfirmedUS = pd.read_csv('https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/csse_covid_19_time_series/time_series_covid19_confirmed_US.csv');
-        if verbose:
-          print('loading confirmed global cases...')
-        timeSeriesConfirmedGlobal = pd.read_csv('https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/csse_covid_19_time_series/time_series_covid19_confirmed_global.csv');
-        if verbose:
-          print('loading confirmed US deaths...')
-        timeSeriesDeathUS = pd.read_csv('https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/csse_covid_19_time_series/time_series_covid19_deaths_US.csv');
-        if verbose:
-          print('loading confirmed global deaths...')
-        timeSeriesDeathGlobal = pd.read_csv('https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/csse_covid_19_time_series/time_series_covid19_deaths_global.csv');
-        if verbose:
-          print('loading confirmed global recoveries...')
-        timeSeriesRecoveredGlobal = pd.read_csv('https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/csse_covid_19_time_series/time_series_covid19_recovered_global.csv');
-        if verbose:
-          print('loading demographic/region lookup table...')
-        lookupTable = pd.read_csv('https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/UID_ISO_FIPS_LookUp_Table.csv');
-      except:
-        print("ERROR: there was a problem loading the JHU dataset. Details: ")
-        for i in range(len(sys.exc_info())):
-          print("    " + str(sys.exc_info()[i]))
-
-      # now, we want to eliminate unwanted columns from our results. JHU's data is a bit inconsistent across sets, so we'll do this by hand.
-      if verbose:
-        print('Transforming dataframes...')
-      timeSeriesConfirmedUS =  timeSeriesConfirmedUS.drop(['UID','iso2','iso3','code3','FIPS','Combined_Key'], axis=1)
-      timeSeriesDeathUS =  timeSeriesDeathUS.drop(['UID','iso2','iso3','code3','FIPS','Combined_Key'], axis=1)
-      timeSeriesConfirmedUS = timeSeriesConfirmedUS.rename(columns={"Long_": "Long", "Province_State": "Province/State", "Country_Region": "Country/Region", "Admin2": "County"})
-      timeSeriesDeathUS = timeSeriesDeathUS.rename(columns={"Long_": "Long", "Province_State": "Province/State", "Country_Region": "Country/Region", "Admin2": "County"})
-
-      timeSeriesConfirmedUS['Metric'] = 'Confirmed'
-      timeSeriesConfirmedGlobal['Metric'] = 'Confirmed'
-      timeSeriesDeathUS['Metric'] = 'Death'
-      timeSeriesDeathGlobal['Metric'] = 'Death'
-      timeSeriesRecoveredGlobal['Metric'] = 'Recovered'
-
-      timeSeriesConfirmedUS['Source'] = CORVISDatasources.JHU.value
-      timeSeriesConfirmedGlobal['Source'] = CORVISDatasources.JHU.value
-      timeSeriesDeathUS['Source'] = CORVISDatasources.JHU.value
-      timeSeriesDeathGlobal['Source'] = CORVISDatasources.JHU.value
-      timeSeriesRecoveredGlobal['Source'] = CORVISDatasources.JHU.value
-
-
-
-      try:
-        pd.set_option('mode.chained_assignment', None) # temporarily disable 'SettingWithCopyWarning' message
-        timeSeriesConfirmedUS.to_csv(dataPath+'.jhu_timeSeriesConfirmedUS.csv', index=False)
-        timeSeriesConfirmedGlobal.to_csv(dataPath+'.jhu_timeSeriesConfirmedGlobal.csv', index=False)
-        timeSeriesDeathUS.to_csv(dataPath+'.jhu_timeSeriesDeathUS.csv', index=False)
-        timeSeriesDeathGlobal.to_csv(dataPath+'.jhu_timeSeriesDeathGlobal.csv', index=False)
-        timeSeriesRecoveredGlobal.to_csv(dataPath+'.jhu_timeSeriesRecoveredGlobal.csv', index=False)
-        lookupTable.to_csv(dataPath+'.jhu_lookupTable.csv')
-        pd.set_option('mode.chained_assignment', 'warn')
-      except NameError:
-        print("ERROR: one or more JHU datasources failed to download. Please re-run this script.")
-        repoInfo.commit.sha = "BAD_LOCAL_DATA"
-        return;
+      return str(pd.read_json(dataPath + '.ctpRepoInfo.json').lastModified[0])
+    except Exception:
+      return None
 
+  def DownloadFiles(self, fileSpecs, verbose=False):
     if verbose:
-      print('JHU data successfully loaded.')
-    repoInfo.to_json(r'~/.jhuRepoInfo.json')
-
-
-  #############################################
-  ##### LOAD COVID TRACKING PROJECT DATA. #####
-  #############################################
- 
-  if ((datasourceToLoad == CORVISDatasources.ALL) | (datasourceToLoad == CORVISDatasources.COVID_TRACKING)):
+      print('loading CTP state-by-state historical data...')
+    ctpStatesData = pd.read_csv('https://covidtracking.com/api/v1/states/daily.csv')
 
     if verbose:
-      print('Loading CTP data...')
-    ctpMetrics = ['positive', 'negative', 'hospitalizedCumulative', 'inIcuCumulative', 'onVentilatorCumulative', 'recovered', 'death']
-    ctpMetricEnums = [CORVISMetrics.CONFIRMED, CORVISMetrics.NEGATIVE, CORVISMetrics.HOSPITALIZED, CORVISMetrics.ICU, CORVISMetrics.VENTILATOR, CORVISMetrics.RECOVERED, CORVISMetrics.DEATH]
-    ctpDataframes = []
+      print('transforming CTP data...')
+    # transform our date to the standard format we're using (M/D/YY)
+    ctpStatesData['date'] = ctpStatesData['date'].astype(str)
+    ctpStatesData['date'] = ctpStatesData['date'].str[4:6].astype(int).astype(str) + '/' + ctpStatesData['date'].str[6:8].astype(int).astype(str) + '/' + ctpStatesData['date'].str[2:4]
+
+    # CTP uses state abbreviations, whereas our standard uses full names. Fix that with the 'us' module.
+    ctpStatesData['state'] = ctpStatesData['state'].apply(lambda x: str(us.states.lookup(x)))
+
+    # now, we need to transform our data into several timeseries, similar to what JHU has.
+    # to do this, we'll create a dataframe for each metric, pivot it, and flesh it out with standard columns.
+    downloadedFiles = {}
+    for fileSpec in fileSpecs:
+      workingDataframe = ctpStatesData[['state', fileSpec['ctpMetric'], 'date']]
+      workingDataframe = workingDataframe.pivot(index='state',  columns='date', values=workingDataframe.columns[1]).fillna(0).reset_index()
+      workingDataframe.insert(1, 'Long', np.nan, True)
+      workingDataframe.insert(1, 'Lat', np.nan, True)
+      workingDataframe.insert(1, 'Population', np.nan, True)
+      workingDataframe.insert(1, 'County', '', True)
+      workingDataframe.insert(0, 'Country/Region', 'US', True)
+      workingDataframe.insert(0, 'Metric', fileSpec['metrics'][0], True)
+      workingDataframe.insert(0, 'Source', self.datasource.value, True)
+      workingDataframe = workingDataframe.rename(columns={"state": "Province/State"})
+      downloadedFiles[fileSpec['key']] = workingDataframe
+    return downloadedFiles
+
+
+def RegisterCORVISDatasourceAdapter(datasourceAdapter):
+  # add a datasource adapter (an instance of a CORVISDatasourceAdapter subclass)
+  # to the registry LoadCORVISData() picks from. Registering a second adapter
+  # for the same datasource replaces the first.
+  CORVISDatasourceAdapters[datasourceAdapter.datasource.value] = datasourceAdapter
+
+RegisterCORVISDatasourceAdapter(CORVISJHUAdapter())
+RegisterCORVISDatasourceAdapter(CORVISCTPAdapter())
+
+
+def LoadCORVISData(datasourceToLoad = CORVISDatasources.ALL, dataPath='./', forceDownload=False, verbose=True, metric=None, country=None, granularity=None, includePopulation=True):
 
-    proceedWithDownload = False
+  if verbose:
+    print('loading from datasource: ' + str(datasourceToLoad.value))
 
-    try:
-      lastRepoInfoCTP = pd.read_json(dataPath+'.ctpRepoInfo.json') # load the last modified date
-      for i in range(len(ctpMetrics)):
-        ctpDataframes.append(pd.read_csv(dataPath+'.cpt_timeSeries' + ctpMetrics[i] + '.csv'))
-    except:
-      # we haven't connected to the CTP servers yet. Set dummy data.
-      ctpDataframes = []
-      lastRepoInfoCTP = None
-    
-    try:
-      currentRepoInfoCTP = pd.read_json('https://covidtracking.com/api/v1/us/current.json')
-    except:
-      currentRepoInfoCTP = None
-
-    if (currentRepoInfoCTP is None and lastRepoInfoCTP is None):
-      raise IOError("FATAL ERROR: Cannot connect to CTP server, and no local data is available. Aborting.")
-    elif (currentRepoInfoCTP is None):
-      # we can't connect to the server, so just load from disk.
-      print('WARNING: Cannot connect to CTP server. Using local data instead. Data may be out of date.')
-    elif (lastRepoInfoCTP is None):
-      if verbose:
-        print('No CTP data available on local disk. Will download.')
-      proceedWithDownload = True
-    else:
-      if (currentRepoInfoCTP.lastModified[0] != lastRepoInfoCTP.lastModified[0]):
-        # we have both local AND server data, and their fingerprints don't match. Re-download.
-        if verbose:
-          print('Updated CTP data available on server. Will download.')
-          proceedWithDownload = True
+  # work out what we've been asked for. 'None' means "everything".
+  if isinstance(metric, CORVISMetrics):
+    metric = [metric]
+  if (metric is not None):
+    metric = [x.value if isinstance(x, CORVISMetrics) else x for x in metric]
+    if (CORVISMetrics.ALL.value in metric):
+      metric = None
+  if isinstance(country, str):
+    country = [country]
+  if isinstance(granularity, CORVISAggregations):
+    # CORVISAggregations.COUNTY (and NONE) have a value of None; treat them as county-level.
+    granularity = {'global': 'country', 'country': 'country', 'state': 'state', None: 'county'}[granularity.value]
+  if (granularity is not None) and not (granularity in CORVISGranularities):
+    raise ValueError("'granularity' must be one of the following values: 'country', 'state', 'county', None (default)")
+
+  # pick our adapters, and only the files from each that this request needs.
+  selectedAdapters = [x for x in CORVISDatasourceAdapters.values() if (datasourceToLoad == CORVISDatasources.ALL) or (x.datasource.value == datasourceToLoad.value)]
+  loadedDataframes = []
+  lookupTable = None
+  for datasourceAdapter in selectedAdapters:
+    fileSpecs = datasourceAdapter.SelectFiles(metric, country, granularity)
+    if (len(fileSpecs) == 0):
+      continue
+    if includePopulation and (datasourceAdapter.populationFileKey is not None) and (lookupTable is None):
+      fileSpecs = fileSpecs + [x for x in datasourceAdapter.files if x['key'] == datasourceAdapter.populationFileKey]
+    for fileSpec, loadedDataframe in zip(fileSpecs, datasourceAdapter.LoadFiles(fileSpecs, dataPath, forceDownload, verbose)):
+      if (fileSpec['key'] == datasourceAdapter.populationFileKey):
+        lookupTable = loadedDataframe
       else:
-        if verbose:
-          print('Local CTP data is latest. Will not download new data.')
-
-    if forceDownload:
-      if verbose:
-        print("Forcing re-download of CTP data.")
-      proceedWithDownload = True
+        loadedDataframes.append(loadedDataframe)
+    if verbose:
+      print(datasourceAdapter.name.upper() + ' data successfully loaded.')
 
-    if proceedWithDownload:
-      try:
-        if verbose:
-          print('loading CTP state-by-state historical data...')
-        ctpStatesData = pd.read_csv('https://covidtracking.com/api/v1/states/daily.csv');
-      except:
-        print("ERROR: there was a problem loading the CTP dataset. Details: ")
-        for i in range(len(sys.exc_info())):
-          print("    " + str(sys.exc_info()[i]))
-      
-      if verbose:
-        print('transforming CTP data...')
-      # transform our date to the standard format we're using (M/D/YY)
-      ctpStatesData['date'] = ctpStatesData['date'].astype(str)
-      ctpStatesData['date'] = ctpStatesData['date'].str[4:6].astype(int).astype(str) + '/' + ctpStatesData['date'].str[6:8].astype(int).astype(str) + '/' + ctpStatesData['date'].str[2:4]
-
-      # CTP uses state abbreviations, whereas our standard uses full names. Fix that with the 'us' module.
-      ctpStatesData['state'] = ctpStatesData['state'].apply(lambda x: str(us.states.lookup(x)))
-
-      ctpStatesData = ctpStatesData.rename(columns={"Long_": "Long", "Province_State": "Province/State", "Country_Region": "Country/Region", "Admin2": "County"})
-
-      # now, we need to transform our data into several timeseries, similar to what JHU has.
-      # to do this, we'll create a series of dataframes for each metric, pivot them, flesh them out with standard columns, and append them to our unified dataframe.
-      
-      for i in range(len(ctpMetrics)):
-        workingDataframe = ctpStatesData[['state', ctpMetrics[i], 'date']]
-        workingDataframe = workingDataframe.pivot(index='state',  columns='date', values=workingDataframe.columns[1]).fillna(0).reset_index()
-        workingDataframe.insert(1, 'Long', np.nan, True)
-        workingDataframe.insert(1, 'Lat', np.nan, True)
-        workingDataframe.insert(1, 'Population', np.nan, True)
-        workingDataframe.insert(1, 'County', '', True)
-        workingDataframe.insert(0, 'Country/Region', 'US', True)
-        workingDataframe.insert(0, 'Metric', ctpMetricEnums[i].value, True)
-        workingDataframe.insert(0, 'Source', CORVISDatasources.CTP.value, True)
-        workingDataframe = workingDataframe.rename(columns={"state": "Province/State"})
-
-        ctpDataframes.append(workingDataframe)
-      
+  if (len(loadedDataframes) == 0):
+    raise ValueError("ERROR in LoadCORVISData(): none of the selected datasources provide the requested data.")
 
-      try:
-        pd.set_option('mode.chained_assignment', None) # temporarily disable 'SettingWithCopyWarning' message
-        for i in range(len(ctpMetrics)):
-          ctpDataframes[i].to_csv(dataPath+'.cpt_timeSeries' + ctpMetrics[i] + '.csv', index=False)
-        pd.set_option('mode.chained_assignment', 'warn')
-      except NameError:
-        print("ERROR: one or more CTP datasources failed to download. Please re-run this script.")
-        return;
-      if currentRepoInfoCTP is not None:
-        currentRepoInfoCTP.to_json(dataPath+'.ctpRepoInfo.json')
+  # the population table covers every datasource, so if none of the adapters we
+  # loaded data from has one, fetch it from any registered adapter that does.
+  if includePopulation and (lookupTable is None):
+    for datasourceAdapter in CORVISDatasourceAdapters.values():
+      if (datasourceAdapter.populationFileKey is not None):
+        lookupTable = datasourceAdapter.LoadFiles([x for x in datasourceAdapter.files if x['key'] == datasourceAdapter.populationFileKey], dataPath, forceDownload, verbose)[0]
+        break
 
   #####################################################
   ##### END OF LOAD BLOCK. PROCEED WITH CLEANING. #####
@@ -387,16 +527,19 @@ def LoadCORVISData(datasourceToLoad = CORVISDatasources.ALL, dataPath='./', forc
   if verbose:
     print('Data loading complete. Building unified CORVIS dataframe...')
   # construct return dataframe
-  returnDataframe = pd.DataFrame(columns=CORVISBaselineColumnNames)
-  if ((datasourceToLoad == CORVISDatasources.ALL) | (datasourceToLoad == CORVISDatasources.JHU)):
-    returnDataframe = returnDataframe.append([timeSeriesConfirmedUS, timeSeriesDeathUS, timeSeriesConfirmedGlobal, timeSeriesDeathGlobal, timeSeriesRecoveredGlobal], ignore_index=True)
-  if ((datasourceToLoad == CORVISDatasources.ALL) | (datasourceToLoad == CORVISDatasources.CTP)):
-    returnDataframe = returnDataframe.append(ctpDataframes, ignore_index=True)
-  
-  
+  returnDataframe = pd.concat([pd.DataFrame(columns=CORVISBaselineColumnNames)] + loadedDataframes, ignore_index=True)
+
   # strip out "unnamed: 0" index column that was imported with original data
   returnDataframe = returnDataframe.loc[:, ~returnDataframe.columns.str.match('Unnamed')]
 
+  # files hold more than we asked for (every metric for a country, or every
+  # country for a metric): trim to the request before the expensive steps below.
+  if (metric is not None):
+    returnDataframe = returnDataframe[returnDataframe['Metric'].isin(metric)]
+  if (country is not None):
+    returnDataframe = returnDataframe[returnDataframe['Country/Region'].isin(country)]
+  returnDataframe = returnDataframe.reset_index(drop=True)
+
   # Clean up data
   returnDataframe['County'] = returnDataframe['County'].fillna('')
   returnDataframe['Province/State'] = returnDataframe['Province/State'].fillna('')
@@ -411,10 +554,10 @@ def LoadCORVISData(datasourceToLoad = CORVISDatasources.ALL, dataPath='./', forc
 
   returnDataframe['Population'] = returnDataframe['Population'].replace(np.nan, 0)
 
-  if ((datasourceToLoad == CORVISDatasources.ALL) | (datasourceToLoad == CORVISDatasources.JHU)):
+  if (lookupTable is not None):
     returnDataframe['Population'] = returnDataframe.apply(GetCORVISPopulationLambda, args=(lookupTable,), axis=1)
-  else:
-    print("WARNING: 'Population' is only calculated with the JHU dataset.")
+  elif includePopulation:
+    print("WARNING: 'Population' is only calculated when a datasource provides a population table.")
 
   returnDataframe['Population'] = returnDataframe['Population'].fillna(-1)
   returnDataframe['Lat'] = returnDataframe['Lat'].fillna(1000) # fill with easy-to-catch junk data
@@ -430,14 +573,476 @@ def LoadCORVISData(datasourceToLoad = CORVISDatasources.ALL, dataPath='./', forc
 
   if verbose:
     print('CORVIS data successfully loaded. Ready.')
-  return returnDataframe
+  return SetCORVISSchema(returnDataframe)
+
+
+def MapCORVISColumnBlocks(blockFunction, numberOfColumns):
+  # split our date columns into blocks of CORVISAggregationBlockSize columns and
+  # call blockFunction(startColumn, endColumn) for each one on a thread pool.
+  # The heavy lifting in our block functions is done by NumPy, which releases
+  # the GIL, so the blocks really do run side by side.
+  blockSize = max(1, CORVISAggregationBlockSize)
+  blockStarts = list(range(0, numberOfColumns, blockSize))
+  numberOfThreads = CORVISAggregationThreads
+  if numberOfThreads is None:
+    numberOfThreads = os.cpu_count() or 1
+
+  if (numberOfThreads <= 1) or (len(blockStarts) <= 1):
+    return [blockFunction(x, min(x + blockSize, numberOfColumns)) for x in blockStarts]
+  with concurrent.futures.ThreadPoolExecutor(max_workers=min(numberOfThreads, len(blockStarts))) as blockExecutor:
+    return list(blockExecutor.map(lambda x: blockFunction(x, min(x + blockSize, numberOfColumns)), blockStarts))
+
+
+def AggregateCORVISGroups(sourceDataframe, groupColumnNames, aggregatorTuples):
+
+  # This function gives the same result as
+  #   sourceDataframe.groupby(groupColumnNames).agg(aggregatorTuples).reset_index()
+  # but is much faster on wide dataframes. Instead of handing hundreds of date
+  # columns to pandas one at a time, we number our groups once, sort the rows so
+  # each group is a contiguous run, and then reduce blocks of columns at a time
+  # with NumPy's reduceat() on a thread pool.
+
+  groupCodes = sourceDataframe.groupby(groupColumnNames, sort=True).ngroup().to_numpy()
+
+  # rows with a missing group value are dropped, just like groupby() does.
+  rowPositions = np.flatnonzero(groupCodes >= 0)
+  rowPositions = rowPositions[np.argsort(groupCodes[rowPositions], kind='stable')]
+  sortedCodes = groupCodes[rowPositions]
+  groupStarts = np.flatnonzero(np.r_[True, sortedCodes[1:] != sortedCodes[:-1]])
+
+  returnDataframe = sourceDataframe[groupColumnNames].iloc[rowPositions[groupStarts]].reset_index(drop=True)
+
+  # NumPy can only handle numeric columns with a simple reduction. Anything else
+  # (there's rarely more than one or two such columns) goes through pandas.
+  columnDtypes = sourceDataframe.dtypes
+  fastColumns = []
+  slowAggregators = {}
+  for colName, reduceBy in aggregatorTuples.items():
+    if (reduceBy in ['sum', 'mean', 'min', 'max']) and (columnDtypes[colName].kind in 'iuf'):
+      fastColumns.append(colName)
+    else:
+      slowAggregators[colName] = reduceBy
+
+  reducedBlocks = {}
+
+  # columns with the same reduction and type are reduced together. For each such
+  # group, we take a NumPy view of its columns (a plain view when they sit side
+  # by side in one pandas block, as date columns do) and gather the rows into
+  # group order with a single np.take(). The blocks below are then just slices.
+  reduceGroups = collections.OrderedDict()
+  for colName in fastColumns:
+    reduceGroups.setdefault((aggregatorTuples[colName], columnDtypes[colName]), []).append(colName)
+  rowsAreSorted = (len(rowPositions) == sourceDataframe.shape[0]) and bool(np.all(rowPositions == np.arange(len(rowPositions))))
+
+  for (reduceBy, columnDtype), reduceColumns in reduceGroups.items():
+    if (len(rowPositions) == 0):
+      break
+    columnPositions = sourceDataframe.columns.get_indexer(reduceColumns)
+    if np.all(np.diff(columnPositions) == 1):
+      groupValues = sourceDataframe.iloc[:, columnPositions[0] : columnPositions[-1] + 1].to_numpy()
+    else:
+      groupValues = sourceDataframe.iloc[:, columnPositions].to_numpy()
+    # pandas stores each block column by column, so its views come out transposed.
+    # Working on (column x row) arrays keeps every gather and reduction running
+    # along contiguous memory.
+    groupValues = groupValues.T
+    if not rowsAreSorted:
+      groupValues = np.take(groupValues, rowPositions, axis=1)
+
+    def ReduceBlock(startColumn, endColumn):
+      blockValues = groupValues[startColumn : endColumn]
+      if (blockValues.dtype.kind == 'f'):
+        missingValues = np.isnan(blockValues)
+      else:
+        missingValues = None
 
+      if (reduceBy == 'min'):
+        reducedValues = np.fmin.reduceat(blockValues, groupStarts, axis=1)
+      elif (reduceBy == 'max'):
+        reducedValues = np.fmax.reduceat(blockValues, groupStarts, axis=1)
+      else:
+        # like pandas, sums and means skip missing values.
+        if missingValues is not None:
+          blockValues = np.where(missingValues, 0, blockValues)
+        reducedValues = np.add.reduceat(blockValues, groupStarts, axis=1)
+        if (reduceBy == 'mean'):
+          if missingValues is None:
+            valueCounts = np.diff(np.r_[groupStarts, len(rowPositions)])[None, :]
+          else:
+            valueCounts = np.add.reduceat(~missingValues, groupStarts, axis=1)
+          with np.errstate(divide='ignore', invalid='ignore'):
+            reducedValues = reducedValues / valueCounts
+      return reducedValues
+
+    groupResults = np.concatenate(MapCORVISColumnBlocks(ReduceBlock, len(reduceColumns)), axis=0)
+    for i in range(len(reduceColumns)):
+      reducedBlocks[reduceColumns[i]] = groupResults[i]
+
+  if (len(slowAggregators) > 0):
+    slowDataframe = sourceDataframe.groupby(groupColumnNames, sort=True).agg(slowAggregators)
+    for colName in slowAggregators:
+      reducedBlocks[colName] = slowDataframe[colName].to_numpy()
+
+  # put our columns back together in the order they were requested.
+  reducedDataframe = pd.DataFrame({x:reducedBlocks.get(x, []) for x in aggregatorTuples}, index=returnDataframe.index, columns=list(aggregatorTuples))
+  return returnDataframe.join(reducedDataframe)
+
+
+def BuildCORVISDatasourceCube(sourceCORVISDataframe):
 
+  VerifyCORVISDataframe(sourceCORVISDataframe)
+  # This function lines up every datasource in a CORVIS dataframe on a shared
+  # location key (metric, country, state, county) and a shared date axis, and
+  # stores the day-by-day counts in a single 3-D array: layer x location x date.
+  # Once the data is in this shape, combining or comparing datasources is a
+  # single NumPy reduction over the first axis instead of a wide groupby.
 
-def FilterCORVISData(sourceCORVISDataframe, country=None, state=None, county=None, region=None, province=None, aggregateBy=CORVISAggregations.NONE, metric=None, filterMissingPopulation=False, sourceData=CORVISDatasources.ALL, combineDatasources=None, allowStateCodesInFilters=True):
-  
+  datasetBreakpoint = FindCORVISDataframeBreakPoint(sourceCORVISDataframe)
+  infoDataframe = sourceCORVISDataframe.iloc[:, : datasetBreakpoint]
+  valuesArray = sourceCORVISDataframe.iloc[:, datasetBreakpoint :].to_numpy(dtype=float)
+
+  # number each location. We sort our groups so the locations come out in the
+  # same order a groupby() over the same columns would give us.
+  locationGroups = infoDataframe.groupby(CORVISLocationColumnNames, sort=True, dropna=False)
+  locationCodes = locationGroups.ngroup().to_numpy()
+
+  # each datasource normally gets exactly one layer. If a datasource reports the
+  # same location more than once, the extra rows get layers of their own so that
+  # no data is lost when we reduce over the layers.
+  sourceCodes, sourceNames = pd.factorize(infoDataframe['Source'], sort=True)
+  duplicateCodes = infoDataframe.groupby(['Source'] + CORVISLocationColumnNames, sort=False, dropna=False).cumcount().to_numpy()
+  layerKeys, layerCodes = np.unique(sourceCodes * (duplicateCodes.max() + 1) + duplicateCodes, return_inverse=True)
+  layerSources = [str(sourceNames[x]) for x in layerKeys // (duplicateCodes.max() + 1)]
+
+  # Population, Lat, and Long (and anything else in the location information)
+  # are always combined by MAX.
+  locationAggregators = {}
+  for colName in infoDataframe.columns:
+    if not (colName in CORVISAggregatorColumnNames):
+      locationAggregators[colName] = 'max'
+  locationDataframe = locationGroups.agg(locationAggregators).reset_index()
+
+  datasourceCube = np.full((len(layerKeys), locationDataframe.shape[0], valuesArray.shape[1]), np.nan)
+  datasourceCube[layerCodes, locationCodes, :] = valuesArray
+
+  return {'cube': datasourceCube, 'sources': layerSources, 'locations': locationDataframe, 'dates': sourceCORVISDataframe.columns[datasetBreakpoint :]}
+
+
+def ReduceCORVISDatasourceCube(datasourceCube, reduceBy='max'):
+  # collapse the datasource axis of a cube built by BuildCORVISDatasourceCube().
+  # 'min', 'max', and 'mean' match CORVISCombineDatasourcesBy; 'range' gives the
+  # spread (max - min) between datasources, which is a handy disagreement metric.
+  # Missing values are ignored; a location/date with no data at all stays NaN.
+
+  if isinstance(reduceBy, CORVISCombineDatasourcesBy):
+    reduceBy = reduceBy.value
+  if not (reduceBy in ['min', 'max', 'mean', 'range']):
+    raise ValueError("'reduceBy' must be one of the following values: 'min', 'max', 'mean', 'range'")
+
+  cube = datasourceCube['cube']
+  reducedValues = np.empty(cube.shape[1:])
+
+  def ReduceBlock(startColumn, endColumn):
+    cubeBlock = cube[:, :, startColumn : endColumn]
+    if (reduceBy == 'min'):
+      reducedValues[:, startColumn : endColumn] = np.nanmin(cubeBlock, axis=0)
+    elif (reduceBy == 'max'):
+      reducedValues[:, startColumn : endColumn] = np.nanmax(cubeBlock, axis=0)
+    elif (reduceBy == 'mean'):
+      reducedValues[:, startColumn : endColumn] = np.nanmean(cubeBlock, axis=0)
+    else:
+      reducedValues[:, startColumn : endColumn] = np.nanmax(cubeBlock, axis=0) - np.nanmin(cubeBlock, axis=0)
+
+  with warnings.catch_warnings():
+    # NumPy warns about all-NaN slices; those are expected here.
+    warnings.simplefilter('ignore', RuntimeWarning)
+    MapCORVISColumnBlocks(ReduceBlock, cube.shape[2])
+  return reducedValues
+
+
+def CreateCORVISDataframeFromCube(datasourceCube, reducedValues, sourceName='Combined'):
+  # rebuild a CORVIS dataframe from a cube's location information and a reduced
+  # (location x date) array, such as the one returned by ReduceCORVISDatasourceCube().
+  returnDataframe = datasourceCube['locations'].copy()
+  returnDataframe.insert(0, 'Source', sourceName)
+  valuesDataframe = pd.DataFrame(reducedValues, columns=datasourceCube['dates'], index=returnDataframe.index)
+  return SetCORVISSchema(returnDataframe.join(valuesDataframe), returnDataframe.shape[1])
+
+
+def CombineCORVISDatasources(sourceCORVISDataframe, combineBy=CORVISCombineDatasourcesBy.MAX):
+
+  # merge the rows from each datasource that describe the same location into a
+  # single 'Combined' row. Population, Lat, and Long are always combined by MAX.
+  if isinstance(combineBy, CORVISCombineDatasourcesBy):
+    combineBy = combineBy.value
+  if not (combineBy in ['min', 'max', 'mean']):
+    raise ValueError("'combineBy' must be one of the following values: 'min', 'max', 'mean'")
+
+  datasourceCube = BuildCORVISDatasourceCube(sourceCORVISDataframe)
+  returnDataframe = CreateCORVISDataframeFromCube(datasourceCube, ReduceCORVISDatasourceCube(datasourceCube, combineBy))
+
+  # any extra location information (such as 'DayZero') is combined the same way as the data.
+  datasetBreakpoint = FindCORVISDataframeBreakPoint(sourceCORVISDataframe)
+  for colName in sourceCORVISDataframe.columns[: datasetBreakpoint]:
+    if not (colName in CORVISBaselineColumnNames):
+      returnDataframe[colName] = sourceCORVISDataframe.groupby(CORVISLocationColumnNames, sort=True, dropna=False)[colName].agg(combineBy).to_numpy()
+
+  # MIN and MAX of whole numbers are still whole numbers: keep the original integer type if we can.
+  dataColumns = sourceCORVISDataframe.columns[datasetBreakpoint :]
+  if (combineBy != 'mean') and all(pd.api.types.is_integer_dtype(x) for x in sourceCORVISDataframe[dataColumns].dtypes):
+    if not returnDataframe[dataColumns].isna().any().any():
+      returnDataframe[dataColumns] = returnDataframe[dataColumns].astype('int64')
+
+  return SetCORVISSchema(returnDataframe)
+
+
+def ComputeCORVISDatasourceDisagreement(sourceCORVISDataframe, relative=False):
+
+  # For each location and date, compute how far apart our datasources are:
+  # the spread between the highest and lowest reported values. If 'relative'
+  # is True, the spread is divided by the mean of the reported values.
+  # Locations reported by only one datasource have a spread of zero.
+  datasourceCube = BuildCORVISDatasourceCube(sourceCORVISDataframe)
+  disagreementValues = ReduceCORVISDatasourceCube(datasourceCube, 'range')
+  if relative:
+    meanValues = ReduceCORVISDatasourceCube(datasourceCube, 'mean')
+    with np.errstate(divide='ignore', invalid='ignore'):
+      disagreementValues = np.where(meanValues != 0, disagreementValues / meanValues, np.nan)
+
+  return CreateCORVISDataframeFromCube(datasourceCube, disagreementValues, 'Disagreement')
+
+
+
+def BuildCORVISSpatialIndex(sourceCORVISDataframe, cellSizeKm=100):
 
   VerifyCORVISDataframe(sourceCORVISDataframe)
+  # This function builds an index for finding records by location: everything
+  # within some distance of a point, or the nearest few places to it.
+  #
+  # We place every distinct (Lat, Long) on a unit sphere, so that straight-line
+  # distance tracks distance along the Earth's surface, and sort the points into
+  # a grid of cubes about cellSizeKm across. A query only has to look at the
+  # cubes near the point it's asked about. Many records share a location (one
+  # per metric and datasource), so the index works with distinct locations and
+  # keeps track of which rows are at each one.
+  #
+  # Records with placeholder coordinates are left out: we fill missing
+  # coordinates with 1000, and JHU uses (0, 0) for unassigned records.
+
+  latitudes = sourceCORVISDataframe['Lat'].to_numpy(dtype=float)
+  longitudes = sourceCORVISDataframe['Long'].to_numpy(dtype=float)
+  validRows = ~np.isnan(latitudes) & ~np.isnan(longitudes) & (np.abs(latitudes) <= 90) & (np.abs(longitudes) <= 180) & ~((latitudes == 0) & (longitudes == 0))
+
+  rowPositions = np.flatnonzero(validRows)
+  uniqueLocations, rowPoints = np.unique(np.stack([latitudes[rowPositions], longitudes[rowPositions]], axis=1), axis=0, return_inverse=True)
+  pointCoordinates = ConvertCORVISCoordinatesToSphere(uniqueLocations[:, 0], uniqueLocations[:, 1])
+
+  # number each grid cube, then sort our points so each cube's points sit together.
+  cellSize = cellSizeKm / CORVISEarthRadiusKm
+  cellOffset = int(math.ceil(1.0 / cellSize)) + 1
+  cellKeys = GetCORVISSpatialCellKeys(np.floor(pointCoordinates / cellSize).astype(np.int64), cellOffset)
+  pointOrder = np.argsort(cellKeys, kind='stable')
+  pointRank = np.empty(len(pointOrder), dtype=np.int64)
+  pointRank[pointOrder] = np.arange(len(pointOrder))
+
+  return {'points': pointCoordinates[pointOrder], 'cellKeys': cellKeys[pointOrder], 'cellSize': cellSize, 'cellOffset': cellOffset, 'cellSizeKm': cellSizeKm,
+          'rowPositions': rowPositions, 'rowPoints': pointRank[np.ravel(rowPoints)], 'latitudes': latitudes, 'longitudes': longitudes}
+
+def ConvertCORVISCoordinatesToSphere(latitudes, longitudes):
+  latitudes = np.radians(np.asarray(latitudes, dtype=float))
+  longitudes = np.radians(np.asarray(longitudes, dtype=float))
+  return np.stack([np.cos(latitudes) * np.cos(longitudes), np.cos(latitudes) * np.sin(longitudes), np.sin(latitudes)], axis=-1)
+
+def GetCORVISSpatialCellKeys(cellCoordinates, cellOffset):
+  # turn (x, y, z) cube numbers into a single number, with z changing fastest.
+  cellWidth = 2 * cellOffset + 1
+  cellCoordinates = cellCoordinates + cellOffset
+  return (cellCoordinates[..., 0] * cellWidth + cellCoordinates[..., 1]) * cellWidth + cellCoordinates[..., 2]
+
+def QueryCORVISSpatialIndexRadius(spatialIndex, latitude, longitude, radiusKm):
+
+  # find every point in a spatial index within radiusKm of (latitude, longitude).
+  # Returns the point numbers and their distances in km, nearest first.
+  queryPoint = ConvertCORVISCoordinatesToSphere(latitude, longitude)
+  allPoints = spatialIndex['points']
+  # the straight-line (chord) distance that matches radiusKm along the surface.
+  chordRadius = 2 * math.sin(min(radiusKm / CORVISEarthRadiusKm, math.pi) / 2)
+
+  lowCells = np.floor((queryPoint - chordRadius) / spatialIndex['cellSize']).astype(np.int64)
+  highCells = np.floor((queryPoint + chordRadius) / spatialIndex['cellSize']).astype(np.int64)
+  numberOfCells = np.prod(highCells - lowCells + 1)
+
+  if (numberOfCells >= len(allPoints)):
+    # our search covers more cubes than there are points: just check them all.
+    candidatePoints = np.arange(len(allPoints))
+  else:
+    # for each (x, y) column of cubes, the z cubes we need are one run of cell keys.
+    xCells, yCells = np.meshgrid(np.arange(lowCells[0], highCells[0] + 1), np.arange(lowCells[1], highCells[1] + 1), indexing='ij')
+    lowKeys = GetCORVISSpatialCellKeys(np.stack([xCells.ravel(), yCells.ravel(), np.full(xCells.size, lowCells[2])], axis=1), spatialIndex['cellOffset'])
+    highKeys = lowKeys + (highCells[2] - lowCells[2])
+    runStarts = np.searchsorted(spatialIndex['cellKeys'], lowKeys, side='left')
+    runEnds = np.searchsorted(spatialIndex['cellKeys'], highKeys, side='right')
+    candidatePoints = np.concatenate([np.arange(x, y) for x, y in zip(runStarts, runEnds)] + [np.zeros(0, dtype=np.int64)])
+
+  chordDistances = np.linalg.norm(allPoints[candidatePoints] - queryPoint, axis=1)
+  matchingPoints = chordDistances <= chordRadius
+  candidatePoints = candidatePoints[matchingPoints]
+  surfaceDistances = 2 * CORVISEarthRadiusKm * np.arcsin(np.minimum(chordDistances[matchingPoints] / 2, 1.0))
+  distanceOrder = np.argsort(surfaceDistances, kind='stable')
+  return candidatePoints[distanceOrder], surfaceDistances[distanceOrder]
+
+def QueryCORVISSpatialIndexNearest(spatialIndex, latitude, longitude, numberOfPoints, allowedPoints=None, radiusKm=None):
+
+  # find the numberOfPoints points in a spatial index nearest to (latitude,
+  # longitude), optionally only from 'allowedPoints' (a boolean array) and
+  # within radiusKm. We search a small radius first and double it until we've
+  # found enough points: anything outside the radius is further away than
+  # everything inside it, so the nearest points inside are the nearest overall.
+  searchRadius = spatialIndex['cellSizeKm']
+  largestRadius = math.pi * CORVISEarthRadiusKm
+  if radiusKm is not None:
+    largestRadius = min(largestRadius, radiusKm)
+
+  while True:
+    searchRadius = min(searchRadius, largestRadius)
+    foundPoints, foundDistances = QueryCORVISSpatialIndexRadius(spatialIndex, latitude, longitude, searchRadius)
+    if allowedPoints is not None:
+      foundDistances = foundDistances[allowedPoints[foundPoints]]
+      foundPoints = foundPoints[allowedPoints[foundPoints]]
+    if (len(foundPoints) >= numberOfPoints) or (searchRadius >= largestRadius):
+      return foundPoints[: numberOfPoints], foundDistances[: numberOfPoints]
+    searchRadius = searchRadius * 2
+
+def GetCORVISSpatialIndex(sourceCORVISDataframe):
+  # get the spatial index for a dataframe, building it only the first time we
+  # see that dataframe (or if its coordinates have changed since.)
+  cachedIndex = CORVISSpatialIndexCache.get(id(sourceCORVISDataframe), None)
+  if cachedIndex is not None:
+    if np.array_equal(cachedIndex['latitudes'], sourceCORVISDataframe['Lat'].to_numpy(dtype=float), equal_nan=True) and np.array_equal(cachedIndex['longitudes'], sourceCORVISDataframe['Long'].to_numpy(dtype=float), equal_nan=True):
+      CORVISSpatialIndexCache.move_to_end(id(sourceCORVISDataframe))
+      return cachedIndex
+
+  spatialIndex = BuildCORVISSpatialIndex(sourceCORVISDataframe)
+  CORVISSpatialIndexCache[id(sourceCORVISDataframe)] = spatialIndex
+  while (len(CORVISSpatialIndexCache) > CORVISSpatialIndexCacheSize):
+    CORVISSpatialIndexCache.popitem(last=False)
+  return spatialIndex
+
+def FilterCORVISDataByLocation(sourceCORVISDataframe, filteredDataframe, near, radiusKm=None, nearest=None):
+
+  # keep the rows of filteredDataframe (a subset of sourceCORVISDataframe) that
+  # are within radiusKm of 'near', and/or at the 'nearest' closest locations to it.
+  # We use the source dataframe's spatial index, so it's only built once.
+  if sourceCORVISDataframe.index.is_unique:
+    spatialIndex = GetCORVISSpatialIndex(sourceCORVISDataframe)
+    filteredPositions = sourceCORVISDataframe.index.get_indexer(filteredDataframe.index)
+  else:
+    spatialIndex = BuildCORVISSpatialIndex(filteredDataframe)
+    filteredPositions = np.arange(filteredDataframe.shape[0])
+
+  # which locations are still in the running after our other filters?
+  rowPointLookup = np.full(len(spatialIndex['latitudes']), -1, dtype=np.int64)
+  rowPointLookup[spatialIndex['rowPositions']] = spatialIndex['rowPoints']
+  filteredPoints = rowPointLookup[filteredPositions]
+  allowedPoints = np.zeros(len(spatialIndex['points']), dtype=bool)
+  allowedPoints[filteredPoints[filteredPoints >= 0]] = True
+
+  if nearest is not None:
+    selectedPoints = QueryCORVISSpatialIndexNearest(spatialIndex, near[0], near[1], nearest, allowedPoints, radiusKm)[0]
+  else:
+    selectedPoints = QueryCORVISSpatialIndexRadius(spatialIndex, near[0], near[1], radiusKm)[0]
+
+  keepPoints = np.zeros(len(spatialIndex['points']), dtype=bool)
+  keepPoints[selectedPoints] = True
+  return filteredDataframe[(filteredPoints >= 0) & keepPoints[np.maximum(filteredPoints, 0)]]
+
+
+def EnableCORVISFilterCache(maxBytes=256*1024*1024, maxEntries=None):
+  global CORVISFilterCache
+  # Turn on memoization for FilterCORVISData(). Results are keyed by a
+  # fingerprint of the source data and the normalized filter arguments, so
+  # 'NY' and 'New York', or region= and country=, share an entry. Once the
+  # cache holds more than 'maxBytes' (or 'maxEntries' results), the least
+  # recently used results are dropped.
+  CORVISFilterCache = {'entries': collections.OrderedDict(), 'maxBytes': maxBytes, 'maxEntries': maxEntries, 'currentBytes': 0,
+                       'hits': 0, 'misses': 0, 'evictions': 0, 'lock': threading.Lock()}
+
+def DisableCORVISFilterCache():
+  global CORVISFilterCache
+  CORVISFilterCache = None
+
+def ClearCORVISFilterCache():
+  if CORVISFilterCache is not None:
+    EnableCORVISFilterCache(CORVISFilterCache['maxBytes'], CORVISFilterCache['maxEntries'])
+
+def GetCORVISFilterCacheStats():
+  if CORVISFilterCache is None:
+    return None
+  return {'hits': CORVISFilterCache['hits'], 'misses': CORVISFilterCache['misses'], 'evictions': CORVISFilterCache['evictions'],
+          'entries': len(CORVISFilterCache['entries']), 'currentBytes': CORVISFilterCache['currentBytes'],
+          'maxBytes': CORVISFilterCache['maxBytes'], 'maxEntries': CORVISFilterCache['maxEntries']}
+
+def GetCORVISDataFingerprint(sourceCORVISDataframe):
+  # a checksum of everything in the dataframe: column names, index, and values.
+  # If any of it changes, so does the fingerprint. We work it out on every
+  # cache lookup, so that edits made in place are always noticed; zlib.crc32()
+  # runs at memory speed, about twice as fast as a cryptographic hash.
+  datasetBreakpoint = FindCORVISDataframeBreakPoint(sourceCORVISDataframe)
+  dataChecksum = zlib.crc32(repr((sourceCORVISDataframe.shape, list(sourceCORVISDataframe.columns), list(sourceCORVISDataframe.dtypes.astype(str)))).encode('utf-8'))
+  dataChecksum = zlib.crc32(pd.util.hash_pandas_object(sourceCORVISDataframe.iloc[:, : datasetBreakpoint], index=True).to_numpy(), dataChecksum)
+
+  # the day-by-day data is by far the biggest part, so we checksum its raw bytes directly rather than value by value.
+  dataValues = sourceCORVISDataframe.iloc[:, datasetBreakpoint :].to_numpy()
+  if (dataValues.dtype.kind in 'biuf'):
+    if dataValues.flags.f_contiguous:
+      dataValues = dataValues.T
+    dataChecksum = zlib.crc32(np.ascontiguousarray(dataValues), dataChecksum)
+  else:
+    dataChecksum = zlib.crc32(pd.util.hash_pandas_object(sourceCORVISDataframe.iloc[:, datasetBreakpoint :], index=False).to_numpy(), dataChecksum)
+  return (sourceCORVISDataframe.shape, dataChecksum)
+
+def GetCORVISFilterCacheKey(sourceCORVISDataframe, filterArguments):
+  # results for data that has since changed are never looked up again, and age out of the cache like any other unused result.
+  dataFingerprint = GetCORVISDataFingerprint(sourceCORVISDataframe)
+  return (dataFingerprint, tuple((x, tuple(y) if isinstance(y, list) else y) for x, y in sorted(filterArguments.items())))
+
+def GetCORVISFilterCacheEntry(cacheKey):
+  with CORVISFilterCache['lock']:
+    if cacheKey not in CORVISFilterCache['entries']:
+      CORVISFilterCache['misses'] = CORVISFilterCache['misses'] + 1
+      return None
+    CORVISFilterCache['hits'] = CORVISFilterCache['hits'] + 1
+    CORVISFilterCache['entries'].move_to_end(cacheKey)
+    # hand back a copy, so our caller can't change what's in the cache.
+    return CORVISFilterCache['entries'][cacheKey][0].copy()
+
+def SetCORVISFilterCacheEntry(cacheKey, filteredDataframe):
+  entrySize = int(filteredDataframe.memory_usage(index=True, deep=True).sum())
+  if (CORVISFilterCache['maxBytes'] is not None) and (entrySize > CORVISFilterCache['maxBytes']):
+    # this result would push everything else out of the cache. Don't keep it.
+    return
+  with CORVISFilterCache['lock']:
+    if cacheKey in CORVISFilterCache['entries']:
+      CORVISFilterCache['currentBytes'] = CORVISFilterCache['currentBytes'] - CORVISFilterCache['entries'].pop(cacheKey)[1]
+    CORVISFilterCache['entries'][cacheKey] = (filteredDataframe.copy(), entrySize)
+    CORVISFilterCache['currentBytes'] = CORVISFilterCache['currentBytes'] + entrySize
+
+    # evict the least recently used results until we're back under our limits.
+    while (((CORVISFilterCache['maxBytes'] is not None) and (CORVISFilterCache['currentBytes'] > CORVISFilterCache['maxBytes'])) or
+           ((CORVISFilterCache['maxEntries'] is not None) and (len(CORVISFilterCache['entries']) > CORVISFilterCache['maxEntries']))):
+      evictedEntry = CORVISFilterCache['entries'].popitem(last=False)[1]
+      CORVISFilterCache['currentBytes'] = CORVISFilterCache['currentBytes'] - evictedEntry[1]
+      CORVISFilterCache['evictions'] = CORVISFilterCache['evictions'] + 1
+
+
+def NormalizeCORVISFilterArguments(country=None, state=None, county=None, region=None, province=None, aggregateBy=CORVISAggregations.NONE, metric=None, filterMissingPopulation=False, sourceData=CORVISDatasources.ALL, combineDatasources=None, allowStateCodesInFilters=True, near=None, radiusKm=None, nearest=None):
+
+  # This function takes the arguments to FilterCORVISData() and boils them down
+  # to plain, sorted values: aliases are resolved, enumerated types become their
+  # values, '!' entries are split into their own lists, and state codes become
+  # state names. Two calls that ask for the same data end up with the same
+  # arguments, which is what lets us cache filter results.
+
   # first, check to see if our aliases are in use. If so, confirm that our primary entries aren't, then reassign accordingly.
 
   if (region is not None):
@@ -493,10 +1098,11 @@ def FilterCORVISData(sourceCORVISDataframe, country=None, state=None, county=Non
     state = []
 
 
-  # next, sort our lists so we can compare them.
-  country.sort()
-  county.sort()
-  state.sort()
+  # next, sort our lists so we can compare them. (We sort copies: the lists belong to our caller.)
+  country = sorted(country)
+  county = sorted(county)
+  state = sorted(state)
+  metric = list(metric)
 
   # get our datasource, and warn if it isn't the enumerated type.
   if isinstance(sourceData, CORVISDatasources):
@@ -552,8 +1158,6 @@ def FilterCORVISData(sourceCORVISDataframe, country=None, state=None, county=Non
     raise ValueError("'combineDatasources' must be one of the following values: 'min', 'max', 'mean', None (default)")
 
 
-  returnDataframe = sourceCORVISDataframe.copy()
-
   # loop through our filter lists and extract any string that begins with '!'.
   # Put these values into a "does not include" filter list after removing the
   # '!' at the front.
@@ -601,36 +1205,100 @@ def FilterCORVISData(sourceCORVISDataframe, country=None, state=None, county=Non
       if us.states.lookup(notState[i]):
         notState[i] = str(us.states.lookup(notState[i]))
 
+  # location filters: 'near' is a (Lat, Long) pair, and needs 'radiusKm', 'nearest', or both.
+  if (near is not None):
+    if (radiusKm is None) and (nearest is None):
+      raise ValueError("ERROR: 'near' must be used with 'radiusKm', 'nearest', or both.")
+    near = (float(near[0]), float(near[1]))
+    if (radiusKm is not None):
+      radiusKm = float(radiusKm)
+    if (nearest is not None):
+      nearest = int(nearest)
+  elif (radiusKm is not None) or (nearest is not None):
+    raise ValueError("ERROR: 'radiusKm' and 'nearest' need a location: use 'near' to give one as (Lat, Long).")
+
+  return {'country': sorted(country), 'notCountry': sorted(notCountry), 'state': sorted(state), 'notState': sorted(notState), 'county': sorted(county), 'notCounty': sorted(notCounty),
+          'metric': sorted(metric), 'aggregateBy': aggregateBy, 'filterMissingPopulation': bool(filterMissingPopulation), 'sourceData': sourceData, 'combineDatasources': combineDatasources,
+          'near': near, 'radiusKm': radiusKm, 'nearest': nearest}
+
+
+def FilterCORVISData(sourceCORVISDataframe, country=None, state=None, county=None, region=None, province=None, aggregateBy=CORVISAggregations.NONE, metric=None, filterMissingPopulation=False, sourceData=CORVISDatasources.ALL, combineDatasources=None, allowStateCodesInFilters=True, near=None, radiusKm=None, nearest=None):
 
 
-  # filter before we aggregate: it's faster!
-  # if we need to filter our values, go in order of coarsest to finest: country, then state, then county.
+  VerifyCORVISDataframe(sourceCORVISDataframe)
+  filterArguments = NormalizeCORVISFilterArguments(country=country, state=state, county=county, region=region, province=province, aggregateBy=aggregateBy, metric=metric, filterMissingPopulation=filterMissingPopulation, sourceData=sourceData, combineDatasources=combineDatasources, allowStateCodesInFilters=allowStateCodesInFilters, near=near, radiusKm=radiusKm, nearest=nearest)
+
+  # if the filter cache is on, and we've run this exact filter on this exact data before, we're done.
+  if CORVISFilterCache is not None:
+    cacheKey = GetCORVISFilterCacheKey(sourceCORVISDataframe, filterArguments)
+    cachedDataframe = GetCORVISFilterCacheEntry(cacheKey)
+    if cachedDataframe is not None:
+      return cachedDataframe
+
+  returnDataframe = SetCORVISSchema(FilterCORVISDataUncached(sourceCORVISDataframe, filterArguments))
+
+  if CORVISFilterCache is not None:
+    SetCORVISFilterCacheEntry(cacheKey, returnDataframe)
+  return returnDataframe
+
+
+def FilterCORVISDataUncached(sourceCORVISDataframe, filterArguments):
+  # the filtering and aggregation behind FilterCORVISData(), using arguments
+  # from NormalizeCORVISFilterArguments().
+  country = filterArguments['country']
+  notCountry = filterArguments['notCountry']
+  state = filterArguments['state']
+  notState = filterArguments['notState']
+  county = filterArguments['county']
+  notCounty = filterArguments['notCounty']
+  metric = filterArguments['metric']
+  aggregateBy = filterArguments['aggregateBy']
+  filterMissingPopulation = filterArguments['filterMissingPopulation']
+  sourceData = filterArguments['sourceData']
+  combineDatasources = filterArguments['combineDatasources']
+
+  # filter before we aggregate: it's faster! We build up a single mask of the
+  # rows we want and select them once, so the only day-by-day data we copy is
+  # the rows we keep. (Copying the whole source first would copy every row of,
+  # say, a shared dataset just to throw most of them away.)
+  rowMask = np.ones(sourceCORVISDataframe.shape[0], dtype=bool)
+
   if (country != []):
-    returnDataframe = returnDataframe[returnDataframe['Country/Region'].isin(country)]
+    rowMask &= sourceCORVISDataframe['Country/Region'].isin(country).to_numpy(dtype=bool, na_value=False)
 
   if (state != []):
-    returnDataframe = returnDataframe[returnDataframe['Province/State'].isin(state)]
+    rowMask &= sourceCORVISDataframe['Province/State'].isin(state).to_numpy(dtype=bool, na_value=False)
 
   if (county != []):
-    returnDataframe = returnDataframe[returnDataframe['County'].isin(county)]
+    rowMask &= sourceCORVISDataframe['County'].isin(county).to_numpy(dtype=bool, na_value=False)
 
   if (notCountry != []):
-    returnDataframe = returnDataframe[~returnDataframe['Country/Region'].isin(notCountry)]
+    rowMask &= ~sourceCORVISDataframe['Country/Region'].isin(notCountry).to_numpy(dtype=bool, na_value=False)
 
   if (notState != []):
-    returnDataframe = returnDataframe[~returnDataframe['Province/State'].isin(notState)]
+    rowMask &= ~sourceCORVISDataframe['Province/State'].isin(notState).to_numpy(dtype=bool, na_value=False)
 
   if (notCounty != []):
-    returnDataframe = returnDataframe[~returnDataframe['County'].isin(notCounty)]
+    rowMask &= ~sourceCORVISDataframe['County'].isin(notCounty).to_numpy(dtype=bool, na_value=False)
 
   if (filterMissingPopulation):
-    returnDataframe = returnDataframe[returnDataframe['Population'] > 0]
-    
+    rowMask &= (sourceCORVISDataframe['Population'] > 0).to_numpy(dtype=bool, na_value=False)
+
   if (metric != [CORVISMetrics.ALL.value]):
-    returnDataframe = returnDataframe[returnDataframe['Metric'].isin(metric)]
+    rowMask &= sourceCORVISDataframe['Metric'].isin(metric).to_numpy(dtype=bool, na_value=False)
 
   if (sourceData != CORVISDatasources.ALL.value):
-    returnDataframe = returnDataframe[returnDataframe['Source'] == str(sourceData)]
+    rowMask &= (sourceCORVISDataframe['Source'] == str(sourceData)).to_numpy(dtype=bool, na_value=False)
+
+  if rowMask.all():
+    # nothing filtered out. A shallow copy is enough: the aggregation steps
+    # below replace whole location columns, which never touches the source.
+    returnDataframe = sourceCORVISDataframe.copy(deep=False)
+  else:
+    returnDataframe = sourceCORVISDataframe[rowMask]
+
+  if (filterArguments['near'] is not None):
+    returnDataframe = FilterCORVISDataByLocation(sourceCORVISDataframe, returnDataframe, filterArguments['near'], filterArguments['radiusKm'], filterArguments['nearest'])
 
   try:
     VerifyCORVISDataframe(sourceCORVISDataframe)
@@ -661,7 +1329,7 @@ def FilterCORVISData(sourceCORVISDataframe, country=None, state=None, county=Non
     if (aggregateBy == 'state'):
       # clear all values for counties so they group together
       returnDataframe['County'] = ''
-      returnDataframe = returnDataframe.groupby(CORVISAggregatorColumnNames).agg(aggregatorTuples).reset_index() # ooh, look, our aggregator tuples!
+      returnDataframe = AggregateCORVISGroups(returnDataframe, CORVISAggregatorColumnNames, aggregatorTuples) # ooh, look, our aggregator tuples!
       # also, drop any records that don't have a value for Province/State: those will be nationwide values.
       returnDataframe = returnDataframe[returnDataframe['Province/State'] != '']
 
@@ -669,7 +1337,7 @@ def FilterCORVISData(sourceCORVISDataframe, country=None, state=None, county=Non
       # clear all values for states and counties so they group together
       returnDataframe['County'] = ''
       returnDataframe['Province/State'] = ''
-      returnDataframe = returnDataframe.groupby(CORVISAggregatorColumnNames).agg(aggregatorTuples).reset_index()
+      returnDataframe = AggregateCORVISGroups(returnDataframe, CORVISAggregatorColumnNames, aggregatorTuples)
       # also, drop any records that don't have a value for Country/Region: those will be nationwide values.
       returnDataframe = returnDataframe[returnDataframe['Country/Region'] != '']
 
@@ -677,21 +1345,12 @@ def FilterCORVISData(sourceCORVISDataframe, country=None, state=None, county=Non
       returnDataframe['County'] = ''
       returnDataframe['Province/State'] = ''
       returnDataframe['Country/Region'] = 'Global'
-      returnDataframe = returnDataframe.groupby(CORVISAggregatorColumnNames).agg(aggregatorTuples).reset_index()
+      returnDataframe = AggregateCORVISGroups(returnDataframe, CORVISAggregatorColumnNames, aggregatorTuples)
 
   if (combineDatasources is not None):
     # we want to aggregate our datasources based on the function passed. Note that population, lat, and long are always aggregated by MAX.
-
-    aggregatorTuples = {}
-
-    for colName in returnDataframe:
-      if not (colName in CORVISAggregatorColumnNames):
-        if (colName in ['Lat', 'Long', 'Population']):
-          aggregatorTuples[colName]='max'
-        else:
-          aggregatorTuples[colName]=combineDatasources
-    returnDataframe['Source'] = 'Combined'
-    returnDataframe = returnDataframe.groupby(CORVISAggregatorColumnNames).agg(aggregatorTuples).reset_index()
+    # The datasources are lined up in a (source x location x date) cube, so this is a single reduction.
+    returnDataframe = CombineCORVISDatasources(returnDataframe, combineDatasources)
 
 
   # finally, one more thing to check: if the source dataframe's last column is NA, then there's missing data for the day.
@@ -710,7 +1369,60 @@ def FilterCORVISData(sourceCORVISDataframe, country=None, state=None, county=Non
 
   return returnDataframe
   
-def TransformCORVISDataToDayZero(sourceCORVISDataframe, thresholdValue=100, dropNAColumns=True):
+def BuildCORVISThresholdIndex(sourceCORVISDataframe):
+
+  VerifyCORVISDataframe(sourceCORVISDataframe)
+  # This function builds an index that answers "on what day did each row first
+  # reach this threshold?" for any threshold, without scanning every row. Build
+  # it once for a dataframe, then pass it to TransformCORVISDataToDayZero() as
+  # often as you like (say, every time someone moves a threshold slider.)
+  #
+  # The trick: the first day a series reaches a threshold is also the first day
+  # its running maximum reaches it. For the usual cumulative counts, the running
+  # maximum is just the series itself; for series that dip (corrections, daily
+  # changes, and so on) it smooths out the dips. Either way, the running maximum
+  # never goes down, so we can binary search it.
+
+  datasetBreakpoint = FindCORVISDataframeBreakPoint(sourceCORVISDataframe)
+  valuesArray = sourceCORVISDataframe.iloc[:, datasetBreakpoint :].to_numpy(dtype=float)
+
+  # a missing value never meets a threshold.
+  runningMaximum = np.maximum.accumulate(np.where(np.isnan(valuesArray), -np.inf, valuesArray), axis=1)
+
+  return {'runningMaximum': runningMaximum, 'index': sourceCORVISDataframe.index, 'dates': sourceCORVISDataframe.columns[datasetBreakpoint :]}
+
+def GetCORVISThresholdPositions(thresholdIndex, thresholdValue):
+  # for every row in a threshold index, get the column position of the first
+  # day at or above thresholdValue. Rows that never get there get the number
+  # of days in the dataframe. All rows are binary searched at once.
+  runningMaximum = thresholdIndex['runningMaximum']
+  numberOfRows, numberOfDays = runningMaximum.shape
+  rowNumbers = np.arange(numberOfRows)
+  lowPositions = np.zeros(numberOfRows, dtype=int)
+  highPositions = np.full(numberOfRows, numberOfDays)
+
+  while (lowPositions < highPositions).any():
+    stillSearching = lowPositions < highPositions
+    middlePositions = (lowPositions + highPositions) // 2
+    reachedThreshold = runningMaximum[rowNumbers, np.minimum(middlePositions, numberOfDays - 1)] >= thresholdValue
+    highPositions = np.where(stillSearching & reachedThreshold, middlePositions, highPositions)
+    lowPositions = np.where(stillSearching & ~reachedThreshold, middlePositions + 1, lowPositions)
+
+  return lowPositions
+
+def GetCORVISThresholdDates(thresholdIndex, thresholdValue):
+  # the same as GetCORVISThresholdPositions(), but returns the date (column name)
+  # for each row, or 'INVALID' if the row never reaches thresholdValue.
+  thresholdPositions = GetCORVISThresholdPositions(thresholdIndex, thresholdValue)
+  return pd.Series(GetCORVISThresholdDatesAtPositions(thresholdIndex, thresholdPositions), index=thresholdIndex['index'])
+
+def GetCORVISThresholdDatesAtPositions(thresholdIndex, thresholdPositions):
+  # map positions from GetCORVISThresholdPositions() to dates (column names),
+  # with 'INVALID' for rows that never reached the threshold. Callers that
+  # already have the positions use this to avoid searching a second time.
+  return np.array(thresholdIndex['dates'].append(pd.Index(['INVALID'])), dtype=object)[thresholdPositions]
+
+def TransformCORVISDataToDayZero(sourceCORVISDataframe, thresholdValue=100, dropNAColumns=True, thresholdIndex=None):
 
   VerifyCORVISDataframe(sourceCORVISDataframe)
   # This function converts the default 'counts on a given day' dataframe to a
@@ -718,50 +1430,41 @@ def TransformCORVISDataToDayZero(sourceCORVISDataframe, thresholdValue=100, drop
   # super useful for doing area-by-area comparisons when the disease may not
   # have hit on the same date.
 
-  # First, we split off two dataframes: one with our location information,
-  # the other with our day-by-day count information.
+  # First, we split off our location information from our day-by-day counts.
 
   datasetBreakpoint = FindCORVISDataframeBreakPoint(sourceCORVISDataframe)
-  returnDataframe = sourceCORVISDataframe.copy().iloc[:, : datasetBreakpoint]
-  daysDataframe = sourceCORVISDataframe.copy().iloc[:, (datasetBreakpoint) :]
-
-
-  # we add a "DayZero" column to our location information dataframe, and
-  # apply our 'GetCORVISThresholdDateLambda' function to it. This lambda function
-  # runs down each column until it finds the first day that meets or exceeds
-  # the given thresholdValue, then returns the column name for that cell.
+  returnDataframe = sourceCORVISDataframe.iloc[:, : datasetBreakpoint].copy()
+  valuesArray = sourceCORVISDataframe.iloc[:, datasetBreakpoint :].to_numpy(dtype=float)
+  numberOfDays = valuesArray.shape[1]
 
-  returnDataframe['DayZero'] = daysDataframe.apply(GetCORVISThresholdDateLambda, args=(thresholdValue, daysDataframe), axis=1)
+  # Next, we find the first day that meets or exceeds the given thresholdValue
+  # for every row. If we were handed a threshold index (see
+  # BuildCORVISThresholdIndex()), make sure it belongs to this dataframe.
+  if thresholdIndex is None:
+    thresholdIndex = BuildCORVISThresholdIndex(sourceCORVISDataframe)
+  elif not ((thresholdIndex['runningMaximum'].shape == valuesArray.shape) and thresholdIndex['dates'].equals(sourceCORVISDataframe.columns[datasetBreakpoint :]) and thresholdIndex['index'].equals(sourceCORVISDataframe.index)):
+    raise ValueError("ERROR in TransformCORVISDataToDayZero(): the given thresholdIndex was not built from this dataframe.")
 
-  # Now, we create a 'DayZero' column on our day-by-day count dataframe,
-  # and copy the values from our information dataframe onto it.
-  daysDataframe.insert(0, 'DayZero', 0, True)
-  daysDataframe['DayZero'] = returnDataframe['DayZero']
+  thresholdPositions = GetCORVISThresholdPositions(thresholdIndex, thresholdValue)
+  returnDataframe['DayZero'] = GetCORVISThresholdDatesAtPositions(thresholdIndex, thresholdPositions)
 
   # Then, we remove any rows that have an 'INVALID' day zero: that is,
   # the record didn't ever make it to the thresholdValue, and won't appear
   # in our results.
-  returnDataframe = returnDataframe[returnDataframe['DayZero'] != 'INVALID']
-  daysDataframe = daysDataframe[daysDataframe['DayZero'] != 'INVALID']
-
-  # now we participate in the darkest of majicks, where we shift all of the
-  # data in each row of our day-by-day dataframe to the left.
-  # The number of columns we shift to the left is determined by the column
-  # index number of the column name that corresponds with the value in our
-  # 'DayZero' record. Thus, if 'DayZero' says 2/1/20, and 2/1/20 is, say,
-  # the 10th column, we'll shift all values for that record left 10 columns.
-  # You can drop a `print(daysDataframe.head())' above and below this for loop
-  # if you want to see what's going on. It's spooky.
-  for i in range(0, daysDataframe.shape[0]):
-    columnNameToGet = daysDataframe.iloc[i,0]
-    daysDataframe.iloc[[i]] = daysDataframe.iloc[[i]].shift(periods=1-daysDataframe.iloc[[i]].columns.get_loc(columnNameToGet), axis=1)
-
-  # Almost done! We drop the 'DayZero' column from our day-by-day dataframe...
-  daysDataframe = daysDataframe.drop('DayZero', axis=1)
-
-  # ...and rename all of our remaining columns to the number of days since
-  # day zero: '0', '1', '2', and so on.
-  daysDataframe = daysDataframe.rename(columns={x:y for x,y in zip(daysDataframe.columns,range(0,len(daysDataframe.columns)))})
+  validRows = thresholdPositions < numberOfDays
+  returnDataframe = returnDataframe[validRows]
+  thresholdPositions = thresholdPositions[validRows]
+  valuesArray = valuesArray[validRows]
+
+  # now we shift all of the data in each row to the left, so that each row's
+  # day zero lands in the first column. We do all rows at once: for every row,
+  # new column N takes the value from old column (day zero + N). Anything that
+  # runs off the end of our data becomes NaN.
+  sourcePositions = thresholdPositions[:, None] + np.arange(numberOfDays)[None, :]
+  shiftedValues = np.where(sourcePositions < numberOfDays, np.take_along_axis(valuesArray, np.minimum(sourcePositions, numberOfDays - 1), axis=1), np.nan)
+
+  # our new columns are named for the number of days since day zero: 0, 1, 2, and so on.
+  daysDataframe = pd.DataFrame(shiftedValues, index=returnDataframe.index, columns=range(0, numberOfDays))
 
   # join our two dataframes back together, and we're set!
   returnDataframe = returnDataframe.join(daysDataframe)
@@ -774,51 +1477,350 @@ def TransformCORVISDataToDayZero(sourceCORVISDataframe, thresholdValue=100, drop
   if returnDataframe.shape[0] == 0:
     raise ValueError("ERROR in TransformCORVISDataToDayZero(): the given thresholdValue (" + str(thresholdValue) + ") is too high. No data returned.")
 
-  return returnDataframe
-
-def ComputeCORVISMovingAverage(sourceCORVISDataframe, windowRange=7):
+  return SetCORVISSchema(returnDataframe, datasetBreakpoint + 1)
+
+def ApplyCORVISColumnTransform(sourceCORVISDataframe, transformBlock, lookBack=0, inplace=False, out=None):
+
+  # This function runs a day-by-day transform over a CORVIS dataframe one block
+  # of CORVISAggregationBlockSize date columns at a time. transformBlock() gets
+  # a float array holding the block plus up to 'lookBack' earlier columns, the
+  # position of the first column in that array, and the position of the first
+  # column of the block; it returns the transformed block.
+  #
+  # There are three places the results can go:
+  #   - by default, into a new CORVIS dataframe (the source is untouched.)
+  #   - with 'out', into a preallocated (rows x days) NumPy array. The returned
+  #     dataframe's day-by-day data is that array, not a copy of it.
+  #   - with 'inplace', straight back into the source dataframe's own columns.
+  #     We work from the last block to the first, so the earlier columns a block
+  #     looks back at haven't been overwritten yet.
+  # With 'out' or 'inplace', the extra memory we need is bounded by a small
+  # number of blocks (plus lookBack columns), no matter how many days there are:
+  # the block we read, transformBlock()'s result, and whatever scratch space
+  # transformBlock() needs. That's about two blocks for ComputeCORVISPerCapita()
+  # and ComputeCORVISDailyChange(), and about four and a half for
+  # ComputeCORVISMovingAverage(), which keeps its scratch buffers between blocks.
 
-  VerifyCORVISDataframe(sourceCORVISDataframe)
   datasetBreakpoint = FindCORVISDataframeBreakPoint(sourceCORVISDataframe)
-  returnDataframe = sourceCORVISDataframe.copy().iloc[:, : datasetBreakpoint]
-  averagesDataframe = sourceCORVISDataframe.copy().iloc[:, (datasetBreakpoint) :]
-  for i in range(windowRange):
-    averagesDataframe.insert(0, 'dummy'+str(i), 0)
-    averagesDataframe.iloc[:,0] = averagesDataframe.iloc[:,i+1]
+  numberOfRows = sourceCORVISDataframe.shape[0]
+  numberOfDays = sourceCORVISDataframe.shape[1] - datasetBreakpoint
+  blockSize = max(1, CORVISAggregationBlockSize)
+
+  if inplace and (out is not None):
+    raise ValueError("ERROR: 'inplace' and 'out' cannot be used at the same time.")
+
+  if inplace:
+    # our results are fractions, so whole-number columns need to become floats.
+    # This is the one time we need a full extra copy of the day-by-day data.
+    dataColumns = sourceCORVISDataframe.columns[datasetBreakpoint :]
+    if not all(x == np.dtype('float64') for x in sourceCORVISDataframe.dtypes.iloc[datasetBreakpoint :]):
+      sourceCORVISDataframe[dataColumns] = sourceCORVISDataframe[dataColumns].astype('float64')
+    resultsArray = None
+  elif out is not None:
+    if (out.shape != (numberOfRows, numberOfDays)):
+      raise ValueError("ERROR: 'out' must be an array of shape " + str((numberOfRows, numberOfDays)) + ".")
+    resultsArray = out
+  else:
+    resultsArray = np.empty((numberOfRows, numberOfDays))
+
+  for startColumn in reversed(range(0, numberOfDays, blockSize)):
+    endColumn = min(startColumn + blockSize, numberOfDays)
+    readStart = max(startColumn - lookBack, 0)
+    readBlock = sourceCORVISDataframe.iloc[:, datasetBreakpoint + readStart : datasetBreakpoint + endColumn].to_numpy(dtype=float)
+    resultBlock = transformBlock(readBlock, readStart, startColumn)
+    if inplace:
+      sourceCORVISDataframe.iloc[:, datasetBreakpoint + startColumn : datasetBreakpoint + endColumn] = resultBlock
+    else:
+      resultsArray[:, startColumn : endColumn] = resultBlock
 
-  averagesDataframe = averagesDataframe.rolling(windowRange, axis=1).mean()
+  if inplace:
+    return sourceCORVISDataframe
 
-  averagesDataframe = averagesDataframe.iloc[:,windowRange:]
+  if out is not None:
+    # wrap our caller's array without copying it, then slot the location information in front.
+    returnDataframe = pd.DataFrame(out, index=sourceCORVISDataframe.index, columns=sourceCORVISDataframe.columns[datasetBreakpoint :], copy=False)
+    for i in range(datasetBreakpoint):
+      returnDataframe.insert(i, sourceCORVISDataframe.columns[i], sourceCORVISDataframe.iloc[:, i])
+    return SetCORVISSchema(returnDataframe, datasetBreakpoint)
 
-  returnDataframe = returnDataframe.join(averagesDataframe)
+  returnDataframe = sourceCORVISDataframe.iloc[:, : datasetBreakpoint].copy()
+  returnDataframe = returnDataframe.join(pd.DataFrame(resultsArray, index=sourceCORVISDataframe.index, columns=sourceCORVISDataframe.columns[datasetBreakpoint :]))
+  return SetCORVISSchema(returnDataframe, datasetBreakpoint)
 
-  return(returnDataframe)
+def ComputeCORVISMovingAverage(sourceCORVISDataframe, windowRange=7, inplace=False, out=None):
 
-def ComputeCORVISDailyChange(sourceCORVISDataframe):  
   VerifyCORVISDataframe(sourceCORVISDataframe)
+  # A plain rolling average either leaves the start of our data as N/A or
+  # pushes the end of our window into the future, neither of which we want.
+  # So we pretend the first day's value was also reported on each of the
+  # windowRange days before it. That gives us a bit of a lead-in on the front end.
+  datasetBreakpoint = FindCORVISDataframeBreakPoint(sourceCORVISDataframe)
+  firstDayValues = sourceCORVISDataframe.iloc[:, datasetBreakpoint].to_numpy(dtype=float)
+
+  # scratch space for one block plus its look-back window, allocated once and
+  # reused for every block, so the kernel itself doesn't allocate per block.
+  numberOfRows = sourceCORVISDataframe.shape[0]
+  extendedWidth = min(max(1, CORVISAggregationBlockSize), sourceCORVISDataframe.shape[1] - datasetBreakpoint) + windowRange - 1
+  extendedBuffer = np.empty((numberOfRows, extendedWidth))
+  missingBuffer = np.empty((numberOfRows, extendedWidth), dtype=bool)
+  sumsBuffer = np.zeros((numberOfRows, extendedWidth + 1))
+  averagesBuffer = np.empty((numberOfRows, extendedWidth - windowRange + 1))
+
+  def AverageBlock(readBlock, readStart, startColumn):
+    leadInColumns = (windowRange - 1) - (startColumn - readStart)
+    blockWidth = readStart + readBlock.shape[1] - startColumn
+    extendedBlock = extendedBuffer[:, : blockWidth + windowRange - 1]
+    if (leadInColumns > 0):
+      extendedBlock[:, : leadInColumns] = firstDayValues[:, None]
+    extendedBlock[:, max(leadInColumns, 0) :] = readBlock
+    # a window with any missing values in it has a missing average. The rolling
+    # sums are differences of running totals (see ComputeCORVISRollingSums()).
+    missingValues = missingBuffer[:, : extendedBlock.shape[1]]
+    np.isnan(extendedBlock, out=missingValues)
+    extendedBlock[missingValues] = 0
+    runningTotals = sumsBuffer[:, : extendedBlock.shape[1] + 1]
+    windowAverages = averagesBuffer[:, : blockWidth]
+    np.cumsum(extendedBlock, axis=1, out=runningTotals[:, 1 :])
+    np.subtract(runningTotals[:, windowRange :], runningTotals[:, : blockWidth], out=windowAverages)
+    np.divide(windowAverages, windowRange, out=windowAverages)
+    np.cumsum(missingValues, axis=1, dtype=float, out=runningTotals[:, 1 :])
+    np.greater(runningTotals[:, windowRange :], runningTotals[:, : blockWidth], out=missingValues[:, : blockWidth])
+    windowAverages[missingValues[:, : blockWidth]] = np.nan
+    return windowAverages
+
+  return ApplyCORVISColumnTransform(sourceCORVISDataframe, AverageBlock, windowRange - 1, inplace, out)
+
+def ComputeCORVISDailyChange(sourceCORVISDataframe, inplace=False, out=None):
+  VerifyCORVISDataframe(sourceCORVISDataframe)
+
+  def ChangeBlock(readBlock, readStart, startColumn):
+    # subtract straight into the result, rather than building a padded copy
+    # of the block for np.diff().
+    changeBlock = np.empty((readBlock.shape[0], readBlock.shape[1] - (startColumn - readStart)))
+    np.subtract(readBlock[:, 1 :], readBlock[:, : -1], out=changeBlock[:, changeBlock.shape[1] - (readBlock.shape[1] - 1) :])
+    if (startColumn == 0):
+      # the first day has nothing to change from; call it zero.
+      changeBlock[:, 0] = 0
+    return changeBlock
+
+  return ApplyCORVISColumnTransform(sourceCORVISDataframe, ChangeBlock, 1, inplace, out)
 
+def ComputeCORVISPerCapita(sourceCORVISDataframe, denominator=1, inplace=False, out=None):
+  VerifyCORVISDataframe(sourceCORVISDataframe)
+  populationValues = (sourceCORVISDataframe['Population'].to_numpy(dtype=float) / denominator)[:, None]
+
+  def PerCapitaBlock(readBlock, readStart, startColumn):
+    with np.errstate(divide='ignore', invalid='ignore'):
+      return readBlock / populationValues
+
+  return ApplyCORVISColumnTransform(sourceCORVISDataframe, PerCapitaBlock, 0, inplace, out)
+
+def ComputeCORVISRollingSums(valuesArray, windowRange):
+  # the sum of the last windowRange columns (including this one) at every
+  # column, for every row at once. Missing values should be zeroed first.
+  cumulativeSums = np.concatenate([np.zeros((valuesArray.shape[0], 1)), np.cumsum(valuesArray, axis=1)], axis=1)
+  windowEnds = np.arange(1, valuesArray.shape[1] + 1)
+  windowStarts = np.maximum(windowEnds - windowRange, 0)
+  return cumulativeSums[:, windowEnds] - cumulativeSums[:, windowStarts]
+
+def ComputeCORVISRollingLogSlope(valuesArray, windowRange=7, minimumPeriods=None):
+  # fit a straight line to log(value) over the last windowRange days at every
+  # column, and return the slopes. Rather than running a regression per row and
+  # per day, we use the closed-form least-squares slope:
+  #   slope = (n * sum(t*y) - sum(t) * sum(y)) / (n * sum(t*t) - sum(t)^2)
+  # where every one of those sums is a rolling sum. Zeros, negative values, and
+  # missing values have no logarithm, so they're left out of the fit; windows
+  # with fewer than minimumPeriods usable days (default: all of them) are NaN.
+  if minimumPeriods is None:
+    minimumPeriods = windowRange
+  minimumPeriods = max(minimumPeriods, 2)
+
+  usableValues = (valuesArray > 0) & ~np.isnan(valuesArray)
+  with np.errstate(divide='ignore', invalid='ignore'):
+    logValues = np.where(usableValues, np.log(np.where(usableValues, valuesArray, 1)), 0)
+  # center our day numbers to keep the sums small.
+  dayNumbers = np.arange(valuesArray.shape[1], dtype=float) - (valuesArray.shape[1] - 1) / 2.0
+  dayNumbers = np.where(usableValues, dayNumbers[None, :], 0)
+
+  pointCount = ComputeCORVISRollingSums(usableValues.astype(float), windowRange)
+  sumOfDays = ComputeCORVISRollingSums(dayNumbers, windowRange)
+  sumOfDaysSquared = ComputeCORVISRollingSums(dayNumbers * dayNumbers, windowRange)
+  sumOfLogs = ComputeCORVISRollingSums(logValues, windowRange)
+  sumOfDaysTimesLogs = ComputeCORVISRollingSums(dayNumbers * logValues, windowRange)
+
+  denominator = pointCount * sumOfDaysSquared - sumOfDays * sumOfDays
+  with np.errstate(divide='ignore', invalid='ignore'):
+    logSlopes = (pointCount * sumOfDaysTimesLogs - sumOfDays * sumOfLogs) / denominator
+  return np.where((pointCount >= minimumPeriods) & (denominator > 0), logSlopes, np.nan)
+
+def ComputeCORVISGrowthRate(sourceCORVISDataframe, windowRange=7, minimumPeriods=None):
+  VerifyCORVISDataframe(sourceCORVISDataframe)
+  # the exponential growth rate per day, from a log-linear fit over the last
+  # windowRange days. A rate of 0.1 means values are growing by a factor of
+  # e^0.1 (about 10.5%) per day; negative rates mean values are shrinking.
   datasetBreakpoint = FindCORVISDataframeBreakPoint(sourceCORVISDataframe)
-  returnDataframe = sourceCORVISDataframe.copy().iloc[:, : datasetBreakpoint]
-  dailyChangeDataframe = sourceCORVISDataframe.copy().iloc[:, (datasetBreakpoint) :]
+  returnDataframe = sourceCORVISDataframe.iloc[:, : datasetBreakpoint].copy()
+  valuesArray = sourceCORVISDataframe.iloc[:, datasetBreakpoint :].to_numpy(dtype=float)
 
-  dailyChangeDataframe = dailyChangeDataframe.diff(axis=1)
-  dailyChangeDataframe.iloc[:,0] = dailyChangeDataframe.iloc[:,0].fillna(0)
+  growthRates = ComputeCORVISRollingLogSlope(valuesArray, windowRange, minimumPeriods)
 
-  returnDataframe = returnDataframe.join(dailyChangeDataframe)
+  returnDataframe = returnDataframe.join(pd.DataFrame(growthRates, index=sourceCORVISDataframe.index, columns=sourceCORVISDataframe.columns[datasetBreakpoint :]))
+  return(SetCORVISSchema(returnDataframe, datasetBreakpoint))
 
-  return(returnDataframe)
+def ComputeCORVISDoublingTime(sourceCORVISDataframe, windowRange=7, minimumPeriods=None):
+  VerifyCORVISDataframe(sourceCORVISDataframe)
+  # the number of days it would take values to double at the growth rate
+  # measured over the last windowRange days (see ComputeCORVISGrowthRate().)
+  # Values that aren't growing never double, so their doubling time is NaN.
+  datasetBreakpoint = FindCORVISDataframeBreakPoint(sourceCORVISDataframe)
+  returnDataframe = sourceCORVISDataframe.iloc[:, : datasetBreakpoint].copy()
+  valuesArray = sourceCORVISDataframe.iloc[:, datasetBreakpoint :].to_numpy(dtype=float)
+
+  growthRates = ComputeCORVISRollingLogSlope(valuesArray, windowRange, minimumPeriods)
+  with np.errstate(divide='ignore', invalid='ignore'):
+    doublingTimes = np.where(growthRates > 0, math.log(2) / growthRates, np.nan)
 
-def ComputeCORVISPerCapita(sourceCORVISDataframe, denominator=1):
+  returnDataframe = returnDataframe.join(pd.DataFrame(doublingTimes, index=sourceCORVISDataframe.index, columns=sourceCORVISDataframe.columns[datasetBreakpoint :]))
+  return(SetCORVISSchema(returnDataframe, datasetBreakpoint))
+
+def ComputeCORVISWeekOverWeekRatio(sourceCORVISDataframe, periods=7):
   VerifyCORVISDataframe(sourceCORVISDataframe)
+  # the total over the last 'periods' days divided by the total over the
+  # 'periods' days before that. This is meant for daily values (for example,
+  # after ComputeCORVISDailyChange()): 1.0 means this week matched last week.
+  # Missing days count as zero. Until we have two full periods of data, or if
+  # the earlier period's total isn't positive, the ratio is NaN.
   datasetBreakpoint = FindCORVISDataframeBreakPoint(sourceCORVISDataframe)
-  returnDataframe = sourceCORVISDataframe.copy().iloc[:, : datasetBreakpoint]
-  perCapitaDataframe = sourceCORVISDataframe.copy().iloc[:, (datasetBreakpoint) :]
+  returnDataframe = sourceCORVISDataframe.iloc[:, : datasetBreakpoint].copy()
+  valuesArray = sourceCORVISDataframe.iloc[:, datasetBreakpoint :].to_numpy(dtype=float)
 
-  perCapitaDataframe = perCapitaDataframe.div((returnDataframe['Population'].div(denominator)),axis=0)
+  periodTotals = ComputeCORVISRollingSums(np.nan_to_num(valuesArray), periods)
+  previousTotals = np.full(periodTotals.shape, np.nan)
+  previousTotals[:, periods :] = periodTotals[:, : -periods]
+  with np.errstate(divide='ignore', invalid='ignore'):
+    periodRatios = np.where(previousTotals > 0, periodTotals / previousTotals, np.nan)
+  periodRatios[:, : (2 * periods) - 1] = np.nan
 
-  returnDataframe = returnDataframe.join(perCapitaDataframe)
+  returnDataframe = returnDataframe.join(pd.DataFrame(periodRatios, index=sourceCORVISDataframe.index, columns=sourceCORVISDataframe.columns[datasetBreakpoint :]))
+  return(SetCORVISSchema(returnDataframe, datasetBreakpoint))
 
-  return(returnDataframe)
+def ComputeCORVISLaggedCorrelation(sourceCORVISDataframe, maxLag=14, minLag=None, referenceRow=None, method='auto', returnByLag=False):
+  VerifyCORVISDataframe(sourceCORVISDataframe)
+  # the Pearson correlation between every pair of rows, with the second row
+  # shifted by every lag from minLag (default: -maxLag) to maxLag days. At a lag
+  # of k, day t of the first row is compared with day t+k of the second, over
+  # the days both cover, so a positive lag means the first row leads the second.
+  # Passing referenceRow (an index label) compares that one row against every row.
+  # Missing values count as zero; rows that don't change over an overlap have no
+  # correlation (NaN.) 'method' is 'fft', 'direct', or 'auto' (see below.)
+  #
+  # Returns a dictionary with:
+  #   'correlation': the best (highest) correlation for each pair, as a dataframe
+  #                  indexed by the rows' index labels on both axes.
+  #   'bestLag':     the lag that gave it, in the same layout.
+  #   'lags':        the lags we tried, in order.
+  #   'correlationByLag': only if returnByLag is True, a numpy array of every
+  #                  correlation, shaped (rows, columns, lags). For thousands
+  #                  of rows this is by far the biggest thing we'd allocate.
+  datasetBreakpoint = FindCORVISDataframeBreakPoint(sourceCORVISDataframe)
+  valuesArray = np.nan_to_num(sourceCORVISDataframe.iloc[:, datasetBreakpoint :].to_numpy(dtype=float))
+  numberOfDays = valuesArray.shape[1]
+
+  if minLag is None:
+    minLag = -maxLag
+  if (minLag > maxLag):
+    raise ValueError("ERROR in ComputeCORVISLaggedCorrelation(): 'minLag' can't be greater than 'maxLag'.")
+  if (max(abs(minLag), abs(maxLag)) > numberOfDays - 2):
+    raise ValueError("ERROR in ComputeCORVISLaggedCorrelation(): every lag must leave at least two overlapping days; this dataframe covers " + str(numberOfDays) + " days.")
+  if not (method in ['auto', 'fft', 'direct']):
+    raise ValueError("ERROR in ComputeCORVISLaggedCorrelation(): 'method' must be one of the following values: 'auto' (default), 'fft', 'direct'")
+  lags = np.arange(minLag, maxLag + 1)
+
+  if referenceRow is None:
+    referenceRows = np.arange(valuesArray.shape[0])
+  else:
+    referenceRows = np.flatnonzero(sourceCORVISDataframe.index == referenceRow)[: 1]
+    if (len(referenceRows) == 0):
+      raise ValueError("ERROR in ComputeCORVISLaggedCorrelation(): 'referenceRow' must be an index label in sourceCORVISDataframe.")
+
+  # centering and scaling each row doesn't change its correlations, but keeps
+  # our running totals small enough to subtract without losing precision.
+  valuesArray = valuesArray - valuesArray.mean(axis=1, keepdims=True)
+  rowScales = valuesArray.std(axis=1, keepdims=True)
+  valuesArray = valuesArray / np.where(rowScales > 0, rowScales, 1)
+
+  # running totals, so the sums and sums of squares over any overlap are a single subtraction.
+  runningSums = np.concatenate([np.zeros((valuesArray.shape[0], 1)), np.cumsum(valuesArray, axis=1)], axis=1)
+  runningSquares = np.concatenate([np.zeros((valuesArray.shape[0], 1)), np.cumsum(valuesArray * valuesArray, axis=1)], axis=1)
+  firstStarts = np.maximum(0, -lags)
+  firstEnds = numberOfDays - np.maximum(0, lags)
+  secondStarts = np.maximum(0, lags)
+  secondEnds = numberOfDays - np.maximum(0, -lags)
+  overlapDays = (firstEnds - firstStarts).astype(float)
+  firstSums = runningSums[:, firstEnds] - runningSums[:, firstStarts]
+  firstSquares = runningSquares[:, firstEnds] - runningSquares[:, firstStarts]
+  secondSums = runningSums[:, secondEnds] - runningSums[:, secondStarts]
+  secondSquares = runningSquares[:, secondEnds] - runningSquares[:, secondStarts]
+  firstSpreads = np.maximum(overlapDays * firstSquares - firstSums * firstSums, 0)
+  secondSpreads = np.maximum(overlapDays * secondSquares - secondSums * secondSums, 0)
+
+  # the sum of products over each overlap, for every pair and every lag. We get
+  # these from the FFT of each row: multiplying one row's transform by the
+  # conjugate of another's gives their cross-correlation at every lag at once.
+  # Zero-padding keeps the lags we want from wrapping around into each other.
+  # For a narrow range of lags, one matrix product per lag is cheaper than a
+  # full-length transform per pair, so 'auto' switches to that instead.
+  fftLength = numberOfDays + max(abs(minLag), abs(maxLag))
+  fftLength += fftLength % 2
+  if (method == 'auto'):
+    method = 'fft' if (len(lags) * numberOfDays > 20 * fftLength * math.log2(fftLength)) else 'direct'
+  if (method == 'fft'):
+    rowTransforms = np.fft.rfft(valuesArray, n=fftLength, axis=1)
+    lagPositions = lags % fftLength # negative lags wrap to the end.
+
+  # work through our reference rows in blocks, keeping each block's working
+  # arrays (about four lag-sized arrays per pair, plus the transforms for
+  # 'fft') within CORVISCorrelationBlockBytes. Each block is boiled down to its
+  # best correlations and lags before we move on, so unless returnByLag is set,
+  # nothing (rows x rows x lags) outlives its block.
+  bestCorrelations = np.empty((len(referenceRows), valuesArray.shape[0]))
+  bestLags = np.empty((len(referenceRows), valuesArray.shape[0]))
+  if returnByLag:
+    correlationByLag = np.empty((len(referenceRows), valuesArray.shape[0], len(lags)))
+  bytesPerRow = valuesArray.shape[0] * ((len(lags) * 8 * 4) + ((fftLength * 16 * 2) if (method == 'fft') else 0))
+  blockRows = max(1, CORVISCorrelationBlockBytes // bytesPerRow)
+  for blockStart in range(0, len(referenceRows), blockRows):
+    blockReferences = referenceRows[blockStart : blockStart + blockRows]
+    if (method == 'fft'):
+      crossProducts = np.fft.irfft(np.conj(rowTransforms[blockReferences])[:, None, :] * rowTransforms[None, :, :], n=fftLength, axis=2)[:, :, lagPositions]
+    else:
+      crossProducts = np.empty((len(blockReferences), valuesArray.shape[0], len(lags)))
+      for lagPosition in range(len(lags)):
+        crossProducts[:, :, lagPosition] = valuesArray[blockReferences, firstStarts[lagPosition] : firstEnds[lagPosition]] @ valuesArray[:, secondStarts[lagPosition] : secondEnds[lagPosition]].T
+
+    covariances = overlapDays * crossProducts - firstSums[blockReferences][:, None, :] * secondSums[None, :, :]
+    del crossProducts
+    spreads = np.sqrt(firstSpreads[blockReferences][:, None, :] * secondSpreads[None, :, :])
+    # lags with no correlation are -inf for now, so they never win below.
+    with np.errstate(divide='ignore', invalid='ignore'):
+      blockCorrelations = np.where(spreads > 1e-9 * overlapDays * overlapDays, np.clip(covariances / spreads, -1, 1), -np.inf)
+    del covariances, spreads
+
+    # the best lag for each pair; pairs with no correlation at any lag get NaN.
+    bestPositions = np.argmax(blockCorrelations, axis=2)
+    blockBest = np.take_along_axis(blockCorrelations, bestPositions[:, :, None], axis=2)[:, :, 0]
+    hasCorrelation = blockBest > -np.inf
+    bestCorrelations[blockStart : blockStart + blockRows] = np.where(hasCorrelation, blockBest, np.nan)
+    bestLags[blockStart : blockStart + blockRows] = np.where(hasCorrelation, lags[bestPositions], np.nan)
+    if returnByLag:
+      blockCorrelations[np.isneginf(blockCorrelations)] = np.nan
+      correlationByLag[blockStart : blockStart + blockRows] = blockCorrelations
+
+  rowLabels = sourceCORVISDataframe.index[referenceRows]
+  return {'correlation': pd.DataFrame(bestCorrelations, index=rowLabels, columns=sourceCORVISDataframe.index, copy=False),
+          'bestLag': pd.DataFrame(bestLags, index=rowLabels, columns=sourceCORVISDataframe.index, copy=False),
+          'lags': [int(x) for x in lags],
+          'correlationByLag': correlationByLag if returnByLag else None}
 
 def GetCORVISHighestValues(sourceCORVISDataframe, numberToGet=5):
   VerifyCORVISDataframe(sourceCORVISDataframe)
@@ -828,7 +1830,123 @@ def GetCORVISHighestValues(sourceCORVISDataframe, numberToGet=5):
   sourceCORVISDataframe = sourceCORVISDataframe.nlargest(n=numberToGet, columns='maxValue')
   sourceCORVISDataframe = sourceCORVISDataframe.drop('maxValue', axis=1)
 
-  return sourceCORVISDataframe
+  return SetCORVISSchema(sourceCORVISDataframe, datasetBreakpoint)
+
+def EnableCORVISPlotCache(maxBytes=64*1024*1024, cacheDirectory=None):
+  global CORVISPlotCache
+  # Turn on caching for the charts CreateCORVISPlot() saves to file. Charts are
+  # keyed by a hash of everything that goes into them (the plotted values, dates,
+  # legend, title, labels, scale, style, and image format), so re-saving a chart
+  # whose data hasn't changed just writes out the image we rendered last time.
+  # Images are kept in memory, or as files in cacheDirectory (so they're still
+  # there the next time our script runs.) Once the cache holds more than
+  # 'maxBytes' of images, the least recently used ones are dropped.
+  CORVISPlotCache = {'entries': collections.OrderedDict(), 'maxBytes': maxBytes, 'cacheDirectory': cacheDirectory, 'currentBytes': 0,
+                     'hits': 0, 'misses': 0, 'evictions': 0, 'lock': threading.Lock()}
+  if cacheDirectory is not None:
+    # pick up the images earlier runs left behind, least recently used first.
+    os.makedirs(cacheDirectory, exist_ok=True)
+    cachedFiles = []
+    for fileName in os.listdir(cacheDirectory):
+      cacheKey, fileExtension = os.path.splitext(fileName)
+      if (len(cacheKey) == 40) and all(x in '0123456789abcdef' for x in cacheKey) and (len(fileExtension) > 1):
+        fileInfo = os.stat(os.path.join(cacheDirectory, fileName))
+        cachedFiles.append((fileInfo.st_mtime, fileName, fileInfo.st_size))
+    for fileModified, fileName, fileSize in sorted(cachedFiles):
+      CORVISPlotCache['entries'][fileName] = (None, fileSize)
+      CORVISPlotCache['currentBytes'] = CORVISPlotCache['currentBytes'] + fileSize
+    with CORVISPlotCache['lock']:
+      EvictCORVISPlotCacheEntries()
+
+def DisableCORVISPlotCache():
+  global CORVISPlotCache
+  CORVISPlotCache = None
+
+def ClearCORVISPlotCache():
+  if CORVISPlotCache is not None:
+    if CORVISPlotCache['cacheDirectory'] is not None:
+      for cacheKey in CORVISPlotCache['entries']:
+        try:
+          os.remove(os.path.join(CORVISPlotCache['cacheDirectory'], cacheKey))
+        except OSError:
+          pass
+    EnableCORVISPlotCache(CORVISPlotCache['maxBytes'], CORVISPlotCache['cacheDirectory'])
+
+def GetCORVISPlotCacheStats():
+  if CORVISPlotCache is None:
+    return None
+  return {'hits': CORVISPlotCache['hits'], 'misses': CORVISPlotCache['misses'], 'evictions': CORVISPlotCache['evictions'],
+          'entries': len(CORVISPlotCache['entries']), 'currentBytes': CORVISPlotCache['currentBytes'],
+          'maxBytes': CORVISPlotCache['maxBytes'], 'cacheDirectory': CORVISPlotCache['cacheDirectory']}
+
+def GetCORVISPlotRCParams():
+  # the matplotlib settings a chart will be drawn with (the current rcParams,
+  # with CORVISPlotStyle applied on top, as CreateCORVISPlot() does), so that
+  # changing any of them (say, 'savefig.dpi' or 'font.size') renders a new
+  # image. Settings that only matter for interactive windows are left out.
+  with matplotlib.rc_context():
+    plt.style.use(CORVISPlotStyle)
+    return sorted((x, y) for x, y in dict.items(matplotlib.rcParams) if not x.startswith(('backend', 'interactive', 'toolbar', 'webagg.', 'keymap.')))
+
+def GetCORVISPlotCacheKey(plottingDataframe, plotSettings, imageFormat):
+  # the day-by-day values are hashed as raw bytes; everything else (dates, legend,
+  # title, and so on) is small enough to hash as text.
+  plotFingerprint = hashlib.sha1()
+  plottingValues = np.ascontiguousarray(plottingDataframe.to_numpy(dtype=float))
+  plotFingerprint.update(repr(plottingValues.shape).encode('utf-8'))
+  plotFingerprint.update(plottingValues)
+  plotFingerprint.update(repr(list(plottingDataframe.columns)).encode('utf-8'))
+  plotFingerprint.update(repr(plotSettings + [CORVISPlotStyle, matplotlib.__version__]).encode('utf-8'))
+  return plotFingerprint.hexdigest() + '.' + imageFormat
+
+def GetCORVISPlotCacheEntry(cacheKey):
+  with CORVISPlotCache['lock']:
+    if cacheKey not in CORVISPlotCache['entries']:
+      CORVISPlotCache['misses'] = CORVISPlotCache['misses'] + 1
+      return None
+    imageBytes = CORVISPlotCache['entries'][cacheKey][0]
+    if imageBytes is None:
+      cacheFileName = os.path.join(CORVISPlotCache['cacheDirectory'], cacheKey)
+      try:
+        with open(cacheFileName, 'rb') as cacheFile:
+          imageBytes = cacheFile.read()
+        os.utime(cacheFileName) # keep our least-recently-used order across runs.
+      except OSError:
+        # someone else cleaned up our cache directory. Render it again.
+        CORVISPlotCache['currentBytes'] = CORVISPlotCache['currentBytes'] - CORVISPlotCache['entries'].pop(cacheKey)[1]
+        CORVISPlotCache['misses'] = CORVISPlotCache['misses'] + 1
+        return None
+    CORVISPlotCache['hits'] = CORVISPlotCache['hits'] + 1
+    CORVISPlotCache['entries'].move_to_end(cacheKey)
+    return imageBytes
+
+def SetCORVISPlotCacheEntry(cacheKey, imageBytes):
+  if (CORVISPlotCache['maxBytes'] is not None) and (len(imageBytes) > CORVISPlotCache['maxBytes']):
+    # this image would push everything else out of the cache. Don't keep it.
+    return
+  with CORVISPlotCache['lock']:
+    if cacheKey in CORVISPlotCache['entries']:
+      CORVISPlotCache['currentBytes'] = CORVISPlotCache['currentBytes'] - CORVISPlotCache['entries'].pop(cacheKey)[1]
+    if CORVISPlotCache['cacheDirectory'] is None:
+      CORVISPlotCache['entries'][cacheKey] = (imageBytes, len(imageBytes))
+    else:
+      with open(os.path.join(CORVISPlotCache['cacheDirectory'], cacheKey), 'wb') as cacheFile:
+        cacheFile.write(imageBytes)
+      CORVISPlotCache['entries'][cacheKey] = (None, len(imageBytes))
+    CORVISPlotCache['currentBytes'] = CORVISPlotCache['currentBytes'] + len(imageBytes)
+    EvictCORVISPlotCacheEntries()
+
+def EvictCORVISPlotCacheEntries():
+  # drop the least recently used images until we're back under our limit. Call this with the cache's lock held.
+  while (CORVISPlotCache['maxBytes'] is not None) and (CORVISPlotCache['currentBytes'] > CORVISPlotCache['maxBytes']):
+    evictedKey, evictedEntry = CORVISPlotCache['entries'].popitem(last=False)
+    CORVISPlotCache['currentBytes'] = CORVISPlotCache['currentBytes'] - evictedEntry[1]
+    CORVISPlotCache['evictions'] = CORVISPlotCache['evictions'] + 1
+    if CORVISPlotCache['cacheDirectory'] is not None:
+      try:
+        os.remove(os.path.join(CORVISPlotCache['cacheDirectory'], evictedKey))
+      except OSError:
+        pass
 
 def CreateCORVISPlot(sourceCORVISDataframe, valuesForLegend=None, graphTitle='', xLabel=None, yLabel=None, yScale='linear', startGraphAtThreshold=None, saveToFile=None):
   VerifyCORVISDataframe(sourceCORVISDataframe)
@@ -844,7 +1962,6 @@ def CreateCORVISPlot(sourceCORVISDataframe, valuesForLegend=None, graphTitle='',
   else:
     legendEntries = []
   dataframeBreakpoint = FindCORVISDataframeBreakPoint(sourceCORVISDataframe)
-  infoDataframe = sourceCORVISDataframe.iloc[:, : dataframeBreakpoint]
   plottingDataframe = sourceCORVISDataframe.iloc[:, dataframeBreakpoint :]
 
   if startGraphAtThreshold is not None:
@@ -867,7 +1984,7 @@ def CreateCORVISPlot(sourceCORVISDataframe, valuesForLegend=None, graphTitle='',
   elif (totalDaysPlotted > 20):
     tickSkip = 7
 
-  if 'DayZero' in infoDataframe.columns:
+  if GetCORVISDateAxis(sourceCORVISDataframe) == 'DayZero':
     # we have a 'day zero'-style graph; count up by days
     if xLabel is None:
       xLabel = 'Days since day zero'
@@ -900,14 +2017,38 @@ def CreateCORVISPlot(sourceCORVISDataframe, valuesForLegend=None, graphTitle='',
         axisTickLabels.append(plottingDataframe.columns[currentTick])
       currentTick = currentTick + 1
 
+  if isinstance(valuesForLegend, CORVISPlotValues):
+    for i in range(sourceCORVISDataframe.shape[0]):
+      legendEntries.append(str(sourceCORVISDataframe.iat[int(i),int(sourceCORVISDataframe.columns.get_loc(valuesForLegend.value))]))
+
+  if (saveToFile is not None) and (CORVISPlotCache is not None):
+    # if we've already rendered this exact chart, write out that image rather than drawing it again.
+    if isinstance(saveToFile, (str, os.PathLike)):
+      imageFormat = os.path.splitext(saveToFile)[1][1:].lower()
+    else:
+      imageFormat = ''
+    if imageFormat == '':
+      imageFormat = matplotlib.rcParams['savefig.format']
+      if isinstance(saveToFile, (str, os.PathLike)):
+        # like plt.savefig(), add the default extension to file names without one.
+        saveToFile = os.fspath(saveToFile) + '.' + imageFormat
+    plotSettings = [legendEntries if (valuesForLegend is not None) else None, graphTitle, xLabel, yLabel, yScale, axisTickPoints, axisTickLabels, GetCORVISPlotRCParams()]
+    cacheKey = GetCORVISPlotCacheKey(plottingDataframe, plotSettings, imageFormat)
+    imageBytes = GetCORVISPlotCacheEntry(cacheKey)
+    if imageBytes is not None:
+      if isinstance(saveToFile, (str, os.PathLike)):
+        with open(saveToFile, 'wb') as imageFile:
+          imageFile.write(imageBytes)
+      else:
+        saveToFile.write(imageBytes)
+      return
+
   plt.figure(figsize=(18, 10), dpi= 80, facecolor='w', edgecolor='k')
   plt.style.use(CORVISPlotStyle)
   plt.title(graphTitle)
 
   for i in range(sourceCORVISDataframe.shape[0]):
     plt.plot(plottingDataframe.iloc[i])
-    if isinstance(valuesForLegend, CORVISPlotValues):
-      legendEntries.append(str(sourceCORVISDataframe.iat[int(i),int(sourceCORVISDataframe.columns.get_loc(valuesForLegend.value))]))
   
   if valuesForLegend is not None:
     plt.legend(legendEntries)
@@ -920,6 +2061,296 @@ def CreateCORVISPlot(sourceCORVISDataframe, valuesForLegend=None, graphTitle='',
 
   if saveToFile is None:
     plt.show(block=True)
-  else:
+  elif CORVISPlotCache is None:
     plt.savefig(saveToFile)
+  else:
+    imageBuffer = io.BytesIO()
+    plt.savefig(imageBuffer, format=imageFormat)
+    imageBytes = imageBuffer.getvalue()
+    SetCORVISPlotCacheEntry(cacheKey, imageBytes)
+    if isinstance(saveToFile, (str, os.PathLike)):
+      with open(saveToFile, 'wb') as imageFile:
+        imageFile.write(imageBytes)
+    else:
+      saveToFile.write(imageBytes)
+
+
+def ImportCORVISArrowModule():
+  # pyarrow is an optional dependency: only the Arrow import/export functions need it.
+  try:
+    import pyarrow
+    import pyarrow.feather
+  except ImportError:
+    raise ImportError("ERROR: Arrow import/export requires the 'pyarrow' package. Install it with 'pip install pyarrow' (or 'pip install corvis[arrow]').")
+  return pyarrow
+
+def IsCORVISArrowSchema(objectToCheck):
+  # check for an Arrow schema without importing pyarrow (it may not be installed.)
+  return (type(objectToCheck).__name__ == 'Schema') and type(objectToCheck).__module__.startswith('pyarrow')
+
+def GetCORVISArrowMetadata(arrowSchema):
+  # read the CORVIS information we store in an Arrow schema's metadata on export.
+  if (arrowSchema.metadata is None) or (b'corvis' not in arrowSchema.metadata):
+    return {}
+  return json.loads(arrowSchema.metadata[b'corvis'].decode('utf-8'))
+
+def ExportCORVISDataToArrow(sourceCORVISDataframe, filePath):
+  VerifyCORVISDataframe(sourceCORVISDataframe)
+  pyarrow = ImportCORVISArrowModule()
+
+  # This function writes a CORVIS dataframe to an Arrow IPC file (also known as
+  # Feather V2.) The file is written uncompressed so that other processes can
+  # memory-map it and read the data in place: no parsing and no copying.
+  # Note that the dataframe's index is not saved.
+
+  datasetBreakpoint = FindCORVISDataframeBreakPoint(sourceCORVISDataframe)
+  isDayZero = (GetCORVISDateAxis(sourceCORVISDataframe) == 'DayZero')
+
+  # Arrow column names must be strings. 'Day zero' dataframes use day numbers
+  # for their column names, so we make a note of that and restore them on import.
+  exportDataframe = sourceCORVISDataframe
+  if isDayZero:
+    exportDataframe = sourceCORVISDataframe.rename(columns={x:str(x) for x in sourceCORVISDataframe.columns[datasetBreakpoint :]})
+
+  arrowTable = pyarrow.Table.from_pandas(exportDataframe, preserve_index=False)
+  corvisMetadata = {'breakpoint': datasetBreakpoint, 'dayZero': isDayZero, 'rows': sourceCORVISDataframe.shape[0]}
+  schemaMetadata = dict(arrowTable.schema.metadata or {})
+  schemaMetadata[b'corvis'] = json.dumps(corvisMetadata).encode('utf-8')
+  arrowTable = arrowTable.replace_schema_metadata(schemaMetadata)
+
+  pyarrow.feather.write_feather(arrowTable, filePath, compression='uncompressed')
+
+def ReadCORVISArrowSchema(filePath):
+  pyarrow = ImportCORVISArrowModule()
+  # read only the schema of a CORVIS Arrow file. This reads the file footer, not
+  # the data, so it's a cheap way to check a file with VerifyCORVISDataframe().
+  with pyarrow.memory_map(filePath, 'r') as arrowSource:
+    return pyarrow.ipc.open_file(arrowSource).schema
+
+def ImportCORVISDataFromArrow(filePath, memoryMap=True, returnArrowTable=False):
+  pyarrow = ImportCORVISArrowModule()
+
+  # This function reads a CORVIS dataframe written by ExportCORVISDataToArrow().
+  # With 'memoryMap' on, the file is mapped into memory rather than read, and
+  # numeric columns without missing values share that memory instead of being
+  # copied. If 'returnArrowTable' is True, we hand back the Arrow table itself
+  # without converting to pandas at all. The mapping stays open for as long as
+  # the returned dataframe (or table), or anything taken from it without a
+  # copy, is still around; the file can't be deleted on Windows until then.
+
+  if memoryMap:
+    arrowTable = pyarrow.ipc.open_file(pyarrow.memory_map(filePath, 'r')).read_all()
+  else:
+    # read_all() copies everything into memory, so we're done with the file.
+    with pyarrow.OSFile(filePath, 'r') as arrowSource:
+      arrowTable = pyarrow.ipc.open_file(arrowSource).read_all()
+  VerifyCORVISDataframe(arrowTable.schema)
+
+  if returnArrowTable:
+    return arrowTable
+
+  # split_blocks keeps each column in its own block, so pandas doesn't copy
+  # everything into one big consolidated array.
+  returnDataframe = arrowTable.to_pandas(split_blocks=True)
+
+  corvisMetadata = GetCORVISArrowMetadata(arrowTable.schema)
+  if corvisMetadata.get('dayZero', False):
+    datasetBreakpoint = corvisMetadata['breakpoint']
+    returnDataframe = returnDataframe.rename(columns={x:int(x) for x in returnDataframe.columns[datasetBreakpoint :]})
+
+  return SetCORVISSchema(returnDataframe, corvisMetadata.get('breakpoint', None))
+
+# shared memory segments published by this process (kept open until released), and
+# the arrays of the shared datasets this process has attached to, keyed by segment name.
+# Released segments that something still holds a view of wait in the retired list
+# until they can be closed safely.
+CORVISSharedDataSegments = {}
+CORVISAttachedSharedData = {}
+CORVISRetiredSharedSegments = []
+
+def PublishCORVISSharedData(sourceCORVISDataframe):
+  VerifyCORVISDataframe(sourceCORVISDataframe)
+  from multiprocessing import shared_memory
+
+  # This function copies a CORVIS dataframe into a single block of shared memory
+  # so that worker processes can use it without reloading or unpickling it.
+  # The day-by-day data is stored as one 2-D array. Text columns (source,
+  # metric, location names) are stored as integer codes; the list of distinct
+  # values for each one is small, so it travels in the returned descriptor.
+  # The descriptor is a plain dictionary: pass it to AttachCORVISSharedData()
+  # (or MapCORVISSharedData()) in the workers, and to ReleaseCORVISSharedData()
+  # when you are done.
+
+  datasetBreakpoint = FindCORVISDataframeBreakPoint(sourceCORVISDataframe)
+  dataColumns = list(sourceCORVISDataframe.columns[datasetBreakpoint :])
+  dataDtype = np.result_type(*sourceCORVISDataframe.dtypes.iloc[datasetBreakpoint :])
+  if dataDtype.kind not in 'biuf':
+    dataDtype = np.dtype('float64')
+
+  # lay out every array we need to share, one after the other.
+  arraysToShare = [('data', sourceCORVISDataframe.iloc[:, datasetBreakpoint :].to_numpy(dtype=dataDtype))]
+  metadataColumns = []
+  for colName in sourceCORVISDataframe.columns[: datasetBreakpoint]:
+    currentColumn = sourceCORVISDataframe[colName]
+    if pd.api.types.is_numeric_dtype(currentColumn.dtype):
+      metadataColumns.append({'name': colName, 'dtype': str(currentColumn.dtype), 'categories': None})
+      arraysToShare.append((colName, currentColumn.to_numpy()))
+    else:
+      columnCodes, columnCategories = pd.factorize(currentColumn)
+      metadataColumns.append({'name': colName, 'dtype': str(currentColumn.dtype), 'categories': list(columnCategories)})
+      arraysToShare.append((colName, columnCodes.astype('int32')))
+
+  # the index labels are shared too. Numeric labels are stored as they are;
+  # anything else (text, dates) is stored as integer codes, with the distinct
+  # labels in the descriptor, the same way as the text columns.
+  sourceIndex = sourceCORVISDataframe.index
+  if isinstance(sourceIndex, pd.MultiIndex):
+    raise ValueError("ERROR in PublishCORVISSharedData(): dataframes with a multi-level index can't be shared. Call reset_index() first.")
+  indexInfo = {'name': sourceIndex.name, 'categories': None}
+  if isinstance(sourceIndex.dtype, np.dtype) and (sourceIndex.dtype.kind in 'biuf'):
+    arraysToShare.append(('index', sourceIndex.to_numpy()))
+  else:
+    indexCodes, indexInfo['categories'] = pd.factorize(sourceIndex, use_na_sentinel=False)
+    arraysToShare.append(('index', indexCodes.astype('int64')))
+
+  arrayLayout = {}
+  segmentSize = 0
+  for arrayName, currentArray in arraysToShare:
+    segmentSize = int(math.ceil(segmentSize / 64.0) * 64) # keep every array 64-byte aligned
+    arrayLayout[arrayName] = {'offset': segmentSize, 'dtype': currentArray.dtype.str, 'shape': currentArray.shape}
+    segmentSize = segmentSize + currentArray.nbytes
+
+  sharedSegment = shared_memory.SharedMemory(create=True, size=max(segmentSize, 1))
+  for arrayName, currentArray in arraysToShare:
+    sharedArray = np.frombuffer(sharedSegment.buf, dtype=currentArray.dtype, count=currentArray.size, offset=arrayLayout[arrayName]['offset'])
+    sharedArray[...] = currentArray.reshape(-1)
+  del sharedArray
+  CORVISSharedDataSegments[sharedSegment.name] = sharedSegment
+
+  return {'segmentName': sharedSegment.name, 'layout': arrayLayout, 'dataColumns': dataColumns, 'metadataColumns': metadataColumns, 'index': indexInfo}
+
+def OpenCORVISSharedMemory(segmentName):
+  import multiprocessing
+  from multiprocessing import shared_memory, resource_tracker
+  # if we published this segment ourselves (or inherited it through fork), reuse it.
+  if segmentName in CORVISSharedDataSegments:
+    return CORVISSharedDataSegments[segmentName]
+  # otherwise, attach without handing the segment to the resource tracker:
+  # the publishing process owns it, and is responsible for unlinking it.
+  try:
+    return shared_memory.SharedMemory(name=segmentName, track=False)
+  except TypeError:
+    # Python versions before 3.13 have no 'track' option. Child processes share
+    # their parent's resource tracker, where registering twice is harmless; any
+    # other process has its own tracker, which would unlink the segment on exit.
+    # Only POSIX segments are registered with the tracker, under their name
+    # with a leading slash (the 'name' attribute leaves it off.)
+    sharedSegment = shared_memory.SharedMemory(name=segmentName)
+    if (multiprocessing.parent_process() is None) and (os.name == 'posix'):
+      resource_tracker.unregister('/' + sharedSegment.name.lstrip('/'), 'shared_memory')
+    return sharedSegment
+
+def AttachCORVISSharedData(sharedDescriptor):
+
+  # Rebuild a CORVIS dataframe from a dataset published with
+  # PublishCORVISSharedData(). The day-by-day data is a read-only view of the
+  # shared memory, not a copy; only the small text columns are decoded.
+  # Each process maps the shared arrays and decodes the text columns once, and
+  # reuses them after that. Every call gets a new dataframe around them, so
+  # nothing one caller does to its dataframe is seen by the next.
+
+  segmentName = sharedDescriptor['segmentName']
+  if segmentName not in CORVISAttachedSharedData:
+    CORVISAttachedSharedData[segmentName] = MapCORVISSharedArrays(sharedDescriptor)
+  sharedSegment, dataArray, returnIndex, metadataColumns = CORVISAttachedSharedData[segmentName]
+
+  # start with the data block (no copy), then slot the location information in front of it.
+  returnDataframe = pd.DataFrame(dataArray, columns=sharedDescriptor['dataColumns'], index=returnIndex, copy=False)
+  for i in range(len(metadataColumns)):
+    returnDataframe.insert(i, metadataColumns[i].name, metadataColumns[i])
+
+  return SetCORVISSchema(returnDataframe, len(metadataColumns))
+
+def MapCORVISSharedArrays(sharedDescriptor):
+  # open a shared dataset's memory, and map and decode what's in it: the
+  # day-by-day data array, the index, and the location columns (as Series.)
+  sharedSegment = OpenCORVISSharedMemory(sharedDescriptor['segmentName'])
+  sharedArrays = {}
+  for arrayName, arrayInfo in sharedDescriptor['layout'].items():
+    # np.frombuffer() holds on to the shared buffer, so it can't be closed out from under us.
+    arrayShape = tuple(arrayInfo['shape'])
+    sharedArrays[arrayName] = np.frombuffer(sharedSegment.buf, dtype=np.dtype(arrayInfo['dtype']), count=int(np.prod(arrayShape)), offset=arrayInfo['offset']).reshape(arrayShape)
+    sharedArrays[arrayName].flags.writeable = False
+
+  indexInfo = sharedDescriptor['index']
+  if indexInfo['categories'] is None:
+    returnIndex = pd.Index(sharedArrays['index'], name=indexInfo['name'], copy=False)
+  else:
+    returnIndex = indexInfo['categories'].take(sharedArrays['index']).rename(indexInfo['name'])
+
+  metadataColumns = []
+  for columnInfo in sharedDescriptor['metadataColumns']:
+    if columnInfo['categories'] is None:
+      columnValues = sharedArrays[columnInfo['name']]
+    else:
+      columnValues = pd.Categorical.from_codes(sharedArrays[columnInfo['name']], categories=columnInfo['categories']).astype(columnInfo['dtype'])
+    metadataColumns.append(pd.Series(columnValues, index=returnIndex, name=columnInfo['name'], copy=False))
+
+  return (sharedSegment, sharedArrays['data'], returnIndex, metadataColumns)
+
+def ReleaseCORVISSharedData(sharedDescriptor):
+  # drop this process's view of a shared dataset. If this process published it,
+  # free the shared memory as well. Workers must be finished with it first.
+  segmentName = sharedDescriptor['segmentName']
+  if segmentName in CORVISAttachedSharedData:
+    del CORVISAttachedSharedData[segmentName]
+  if segmentName in CORVISSharedDataSegments:
+    sharedSegment = CORVISSharedDataSegments.pop(segmentName)
+    sharedSegment.unlink()
+    CORVISRetiredSharedSegments.append(sharedSegment)
+
+  # close every released segment that nothing is looking at any more.
+  for sharedSegment in list(CORVISRetiredSharedSegments):
+    try:
+      sharedSegment.close()
+      CORVISRetiredSharedSegments.remove(sharedSegment)
+    except BufferError:
+      # something still holds a view of the data; try again on the next release.
+      pass
+
+def RunCORVISSharedDataSpec(sharedDescriptor, specToRun, ignoreErrors=False):
+
+  # run a single filter/transform spec against a shared dataset. A spec is a
+  # dictionary: 'filter' holds keyword arguments for FilterCORVISData(), and
+  # 'transforms' holds a list of (function, keyword arguments) pairs to apply
+  # in order, e.g. [(ComputeCORVISPerCapita, {'denominator': 100000})].
+  # The shared data is read-only, so the first transform can't use 'inplace'
+  # or 'out' unless the spec filters it into a dataframe of its own first.
+  specTransforms = specToRun.get('transforms', [])
+  if ('filter' not in specToRun) and (len(specTransforms) > 0):
+    if specTransforms[0][1].get('inplace', False) or (specTransforms[0][1].get('out', None) is not None):
+      raise ValueError("ERROR in RunCORVISSharedDataSpec(): 'inplace' and 'out' can't be used on the shared dataset itself. Add a 'filter' to the spec, or leave them off its first transform.")
+
+  try:
+    returnDataframe = AttachCORVISSharedData(sharedDescriptor)
+    if 'filter' in specToRun:
+      returnDataframe = FilterCORVISData(returnDataframe, **specToRun['filter'])
+    for transformFunction, transformArguments in specTransforms:
+      returnDataframe = transformFunction(returnDataframe, **transformArguments)
+  except ValueError:
+    if ignoreErrors:
+      return None
+    raise
+  return returnDataframe
 
+def MapCORVISSharedData(sharedDescriptor, specsToRun, processes=None, ignoreErrors=False):
+  import multiprocessing
+  import functools
+
+  # run a list of filter/transform specs (see RunCORVISSharedDataSpec()) across
+  # a pool of worker processes. Every worker attaches to the shared dataset once
+  # when it starts; the results come back in the same order as the specs.
+  # If 'ignoreErrors' is True, specs that fail (e.g. nothing matched the
+  # filter) return None instead of stopping the whole run.
+  with multiprocessing.Pool(processes, initializer=AttachCORVISSharedData, initargs=(sharedDescriptor,)) as workerPool:
+    return workerPool.map(functools.partial(RunCORVISSharedDataSpec, sharedDescriptor, ignoreErrors=ignoreErrors), specsToRun)
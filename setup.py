@@ -27,4 +27,7 @@ setuptools.setup(
     	'numpy',
     	'matplotlib',
     ],
+    extras_require={
+    	'arrow': ['pyarrow'],
+    },
 )
\ No newline at end of file